@@ -0,0 +1,372 @@
+// Copyright (C) 2020 Jorgen S. Dokken
+//
+// This file is part of DOLFINX_MPC
+//
+// SPDX-License-Identifier:    LGPL-3.0-or-later
+
+#include "assemble_matrix.h"
+#include <dolfinx/common/IndexMap.h>
+#include <dolfinx/common/Timer.h>
+#include <dolfinx/fem/DofMap.h>
+#include <dolfinx/fem/FormIntegrals.h>
+#include <dolfinx/fem/utils.h>
+#include <dolfinx/function/FunctionSpace.h>
+#include <dolfinx/graph/AdjacencyList.h>
+#include <dolfinx/mesh/Mesh.h>
+#include <unordered_set>
+#include <vector>
+
+namespace
+{
+using MatrixXscalar
+    = Eigen::Matrix<PetscScalar, Eigen::Dynamic, Eigen::Dynamic,
+                    Eigen::RowMajor>;
+
+/// Move the slave rows and columns of the element tensor Ae to the
+/// masters of the cell slaves. The moved contributions of the whole
+/// cell and the correction of the already assembled contribution are
+/// accumulated into one dense block, indexed by the cell dofs followed
+/// by all masters on the cell, and inserted with a single
+/// MatSetValuesLocal call. Ae is not modified.
+void modify_mpc_cell(
+    Mat A, const int num_dofs, const MatrixXscalar& Ae,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& cell_dofs,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& slaves,
+    const dolfinx::graph::AdjacencyList<std::int32_t>& masters,
+    const Eigen::Array<PetscScalar, Eigen::Dynamic, 1>& coefficients,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& offsets,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& cell_slaves)
+{
+  const int num_slaves = cell_slaves.rows();
+
+  // Local position of each cell slave within the cell dofs
+  std::vector<std::int32_t> slave_local(num_slaves);
+  for (int i = 0; i < num_slaves; ++i)
+  {
+    for (int k = 0; k < num_dofs; ++k)
+    {
+      if (cell_dofs[k] == slaves[cell_slaves[i]])
+      {
+        slave_local[i] = k;
+        break;
+      }
+    }
+  }
+
+  // Mark the slave positions, so that the accumulation loops can skip
+  // them in a single pass instead of zeroing entries afterwards
+  std::vector<std::int8_t> is_slave(num_dofs, 0);
+  for (int i = 0; i < num_slaves; ++i)
+    is_slave[slave_local[i]] = 1;
+
+  // Position of the first master of the i-th cell slave in the block
+  std::vector<std::int32_t> master_offset(num_slaves + 1);
+  master_offset[0] = num_dofs;
+  for (int i = 0; i < num_slaves; ++i)
+  {
+    master_offset[i + 1]
+        = master_offset[i] + masters.num_links(cell_slaves[i]);
+  }
+
+  // Block indices: the cell dofs followed by all masters on the cell
+  const int size = master_offset[num_slaves];
+  std::vector<PetscInt> block_pos(size);
+  for (int k = 0; k < num_dofs; ++k)
+    block_pos[k] = cell_dofs[k];
+  for (int i = 0; i < num_slaves; ++i)
+  {
+    auto cell_masters = masters.links(cell_slaves[i]);
+    for (int m = 0; m < cell_masters.rows(); ++m)
+      block_pos[master_offset[i] + m] = cell_masters[m];
+  }
+  MatrixXscalar block = MatrixXscalar::Zero(size, size);
+
+  for (int i = 0; i < num_slaves; ++i)
+  {
+    const std::int32_t slave_index = cell_slaves[i];
+    const std::int32_t local = slave_local[i];
+    const int num_masters = offsets[slave_index + 1] - offsets[slave_index];
+    for (int m = 0; m < num_masters; ++m)
+    {
+      const PetscScalar coeff = coefficients[offsets[slave_index] + m];
+      const int mi = master_offset[i] + m;
+      // Move slave row and column to the master with the correct
+      // coefficient, skipping entries at slave dofs (which move to
+      // the master diagonal or to the masters of the other cell
+      // slaves)
+      for (int k = 0; k < num_dofs; ++k)
+      {
+        if (!is_slave[k])
+        {
+          block(k, mi) += coeff * Ae(k, local);
+          block(mi, k) += coeff * Ae(local, k);
+        }
+      }
+      // Add slave contribution to A_(master, master)
+      block(mi, mi) += coeff * coeff * Ae(local, local);
+
+      // Cross terms between the masters of different cell slaves
+      for (int j = i + 1; j < num_slaves; ++j)
+      {
+        const std::int32_t other_slave = cell_slaves[j];
+        const std::int32_t other = slave_local[j];
+        const int num_other
+            = offsets[other_slave + 1] - offsets[other_slave];
+        for (int n = 0; n < num_other; ++n)
+        {
+          const PetscScalar other_coeff
+              = coefficients[offsets[other_slave] + n];
+          const int mj = master_offset[j] + n;
+          block(mi, mj) += coeff * other_coeff * Ae(local, other);
+          block(mj, mi) += coeff * other_coeff * Ae(other, local);
+        }
+      }
+    }
+
+    // Cross terms between different masters of the same slave
+    for (int m0 = 0; m0 < num_masters; ++m0)
+    {
+      for (int m1 = m0 + 1; m1 < num_masters; ++m1)
+      {
+        const PetscScalar v = coefficients[offsets[slave_index] + m0]
+                              * coefficients[offsets[slave_index] + m1]
+                              * Ae(local, local);
+        block(master_offset[i] + m0, master_offset[i] + m1) += v;
+        block(master_offset[i] + m1, master_offset[i] + m0) += v;
+      }
+    }
+  }
+
+  // Correction of the already assembled contribution: subtract the
+  // slave rows and columns, which have been moved to the masters. The
+  // column pass skips slave rows, which the row pass already
+  // subtracted
+  for (int j = 0; j < num_slaves; ++j)
+  {
+    const std::int32_t local = slave_local[j];
+    for (int k = 0; k < num_dofs; ++k)
+    {
+      block(local, k) -= Ae(local, k);
+      if (!is_slave[k])
+        block(k, local) -= Ae(k, local);
+    }
+  }
+
+  // Insert the whole modification in one call
+  MatSetValuesLocal(A, size, block_pos.data(), size, block_pos.data(),
+                    block.data(), ADD_VALUES);
+}
+} // namespace
+
+//-----------------------------------------------------------------------------
+void dolfinx_mpc::assemble_matrix(
+    Mat A, const dolfinx::fem::Form<PetscScalar>& a,
+    const std::shared_ptr<MultiPointConstraint>& mpc,
+    const Eigen::Ref<const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>>&
+        bc_dofs)
+{
+  dolfinx::common::Timer timer("~MPC: Assemble matrix (C++ MPC components)");
+  if (a.rank() != 2)
+  {
+    throw std::runtime_error(
+        "Cannot assemble matrix. Form is not a bilinear form");
+  }
+
+  // Mesh and geometry data
+  std::shared_ptr<const dolfinx::mesh::Mesh> mesh = a.mesh();
+  assert(mesh);
+  const int gdim = mesh->geometry().dim();
+  const int tdim = mesh->topology().dim();
+  const dolfinx::graph::AdjacencyList<std::int32_t>& x_dofmap
+      = mesh->geometry().dofmap();
+  const Eigen::Array<double, Eigen::Dynamic, 3, Eigen::RowMajor>& x_g
+      = mesh->geometry().x();
+
+  // Dofmap data
+  const dolfinx::fem::DofMap& dofmap = *a.function_space(0)->dofmap();
+  const dolfinx::graph::AdjacencyList<std::int32_t>& dofs = dofmap.list();
+  const int num_dofs_per_element = dofmap.element_dof_layout->num_dofs()
+                                   * dofmap.element_dof_layout->block_size();
+
+  // Pack form coefficients and constants
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, Eigen::Dynamic,
+                     Eigen::RowMajor>
+      coeffs = dolfinx::fem::pack_coefficients(a);
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, 1> constants
+      = dolfinx::fem::pack_constants(a);
+
+  // Unpack MPC data
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> slave_cells
+      = mpc->slave_cells();
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> slaves = mpc->slaves();
+  std::shared_ptr<dolfinx::graph::AdjacencyList<std::int32_t>> cell_to_slaves
+      = mpc->cell_to_slaves();
+  std::shared_ptr<dolfinx::graph::AdjacencyList<std::int32_t>> masters
+      = mpc->masters_local();
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, 1> coefficients
+      = mpc->coefficients();
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> offsets
+      = masters->offsets();
+
+  // Map from cell to index in slave_cells (-1 for cells without slaves)
+  std::vector<std::int32_t> cell_to_slave_cell(dofs.num_nodes(), -1);
+  for (std::int32_t i = 0; i < slave_cells.rows(); ++i)
+    cell_to_slave_cell[slave_cells[i]] = i;
+
+  // Dirichlet dofs, whose rows and columns are stripped from the
+  // element tensor before moving contributions to the masters
+  const std::unordered_set<std::int32_t> bc_set(
+      bc_dofs.data(), bc_dofs.data() + bc_dofs.rows());
+
+  const int num_dofs_g = x_dofmap.num_links(0);
+  Eigen::Array<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>
+      coordinate_dofs(num_dofs_g, gdim);
+  MatrixXscalar Ae(num_dofs_per_element, num_dofs_per_element);
+
+  const dolfinx::fem::FormIntegrals<PetscScalar>& integrals = a.integrals();
+
+  // Assemble over cells
+  if (integrals.num_integrals(dolfinx::fem::IntegralType::cell) > 0)
+    mesh->topology_mutable().create_entity_permutations();
+  for (int i = 0;
+       i < integrals.num_integrals(dolfinx::fem::IntegralType::cell); ++i)
+  {
+    const auto& fn
+        = integrals.get_tabulate_tensor(dolfinx::fem::IntegralType::cell, i);
+    const std::vector<std::int32_t>& active_cells
+        = integrals.integral_domains(dolfinx::fem::IntegralType::cell, i);
+    const Eigen::Array<std::uint32_t, Eigen::Dynamic, 1>& cell_perms
+        = mesh->topology().get_cell_permutation_info();
+
+    for (std::int32_t cell : active_cells)
+    {
+      const std::int32_t slave_cell = cell_to_slave_cell[cell];
+      if (slave_cell == -1)
+        continue;
+
+      // If all dofs of the cell are in the Dirichlet bcs, the element
+      // tensor would be zeroed in full, so skip the tabulation
+      auto cell_dofs = dofs.links(cell);
+      int num_bc_dofs = 0;
+      for (int k = 0; k < num_dofs_per_element; ++k)
+      {
+        if (bc_set.count(cell_dofs[k]))
+          ++num_bc_dofs;
+      }
+      if (num_bc_dofs == num_dofs_per_element)
+        continue;
+
+      // Gather cell geometry
+      auto x_dofs = x_dofmap.links(cell);
+      for (int j = 0; j < num_dofs_g; ++j)
+        coordinate_dofs.row(j) = x_g.row(x_dofs[j]).head(gdim);
+
+      Ae.setZero();
+      fn(Ae.data(), coeffs.row(cell).data(), constants.data(),
+         coordinate_dofs.data(), nullptr, nullptr, cell_perms[cell]);
+
+      if (num_bc_dofs > 0)
+      {
+        for (int k = 0; k < num_dofs_per_element; ++k)
+        {
+          if (bc_set.count(cell_dofs[k]))
+          {
+            Ae.row(k).setZero();
+            Ae.col(k).setZero();
+          }
+        }
+      }
+
+      modify_mpc_cell(A, num_dofs_per_element, Ae, cell_dofs, slaves,
+                      *masters, coefficients, offsets,
+                      cell_to_slaves->links(slave_cell));
+    }
+  }
+
+  // Assemble over exterior facets
+  if (integrals.num_integrals(dolfinx::fem::IntegralType::exterior_facet) > 0)
+  {
+    mesh->topology_mutable().create_entities(tdim - 1);
+    mesh->topology_mutable().create_connectivity(tdim - 1, tdim);
+    mesh->topology_mutable().create_entity_permutations();
+  }
+  for (int i = 0;
+       i < integrals.num_integrals(dolfinx::fem::IntegralType::exterior_facet);
+       ++i)
+  {
+    const auto& fn = integrals.get_tabulate_tensor(
+        dolfinx::fem::IntegralType::exterior_facet, i);
+    const std::vector<std::int32_t>& active_facets
+        = integrals.integral_domains(
+            dolfinx::fem::IntegralType::exterior_facet, i);
+    const Eigen::Array<std::uint32_t, Eigen::Dynamic, 1>& cell_perms
+        = mesh->topology().get_cell_permutation_info();
+    const Eigen::Array<std::uint8_t, Eigen::Dynamic, Eigen::Dynamic>&
+        facet_perms
+        = mesh->topology().get_facet_permutations();
+    auto f_to_c = mesh->topology().connectivity(tdim - 1, tdim);
+    auto c_to_f = mesh->topology().connectivity(tdim, tdim - 1);
+    assert(f_to_c);
+    assert(c_to_f);
+
+    for (std::int32_t facet : active_facets)
+    {
+      assert(f_to_c->num_links(facet) == 1);
+      const std::int32_t cell = f_to_c->links(facet)[0];
+      const std::int32_t slave_cell = cell_to_slave_cell[cell];
+      if (slave_cell == -1)
+        continue;
+
+      // Local index of the facet within the cell
+      auto cell_facets = c_to_f->links(cell);
+      int local_facet = 0;
+      for (int j = 0; j < cell_facets.rows(); ++j)
+      {
+        if (cell_facets[j] == facet)
+        {
+          local_facet = j;
+          break;
+        }
+      }
+
+      // If all dofs of the cell are in the Dirichlet bcs, the element
+      // tensor would be zeroed in full, so skip the tabulation
+      auto cell_dofs = dofs.links(cell);
+      int num_bc_dofs = 0;
+      for (int k = 0; k < num_dofs_per_element; ++k)
+      {
+        if (bc_set.count(cell_dofs[k]))
+          ++num_bc_dofs;
+      }
+      if (num_bc_dofs == num_dofs_per_element)
+        continue;
+
+      // Gather cell geometry
+      auto x_dofs = x_dofmap.links(cell);
+      for (int j = 0; j < num_dofs_g; ++j)
+        coordinate_dofs.row(j) = x_g.row(x_dofs[j]).head(gdim);
+
+      Ae.setZero();
+      const std::uint8_t perm = facet_perms(local_facet, cell);
+      fn(Ae.data(), coeffs.row(cell).data(), constants.data(),
+         coordinate_dofs.data(), &local_facet, &perm, cell_perms[cell]);
+
+      if (num_bc_dofs > 0)
+      {
+        for (int k = 0; k < num_dofs_per_element; ++k)
+        {
+          if (bc_set.count(cell_dofs[k]))
+          {
+            Ae.row(k).setZero();
+            Ae.col(k).setZero();
+          }
+        }
+      }
+
+      modify_mpc_cell(A, num_dofs_per_element, Ae, cell_dofs, slaves,
+                      *masters, coefficients, offsets,
+                      cell_to_slaves->links(slave_cell));
+    }
+  }
+}
+//-----------------------------------------------------------------------------
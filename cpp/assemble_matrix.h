@@ -0,0 +1,36 @@
+// Copyright (C) 2020 Jorgen S. Dokken
+//
+// This file is part of DOLFINX_MPC
+//
+// SPDX-License-Identifier:    LGPL-3.0-or-later
+
+#pragma once
+
+#include "MultiPointConstraint.h"
+#include <Eigen/Dense>
+#include <dolfinx/fem/Form.h>
+#include <petscmat.h>
+
+namespace dolfinx_mpc
+{
+
+/// Assemble the multi-point constraint contributions of a bilinear
+/// form into an existing PETSc matrix. The unconstrained contributions
+/// are assumed to already be assembled into A; this routine tabulates
+/// the element tensor of every slave cell, moves the slave rows and
+/// columns to the corresponding masters, and inserts the difference,
+/// mirroring the numba assembler in the Python layer.
+///
+/// @param[in,out] A PETSc matrix with a sparsity pattern created by
+/// MultiPointConstraint::create_sparsity_pattern
+/// @param[in] a The bilinear form
+/// @param[in] mpc The multi-point constraint
+/// @param[in] bc_dofs Local indices of Dirichlet dofs. Their rows and
+/// columns are zeroed in the element tensors before the modification
+void assemble_matrix(
+    Mat A, const dolfinx::fem::Form<PetscScalar>& a,
+    const std::shared_ptr<MultiPointConstraint>& mpc,
+    const Eigen::Ref<const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>>&
+        bc_dofs);
+
+} // namespace dolfinx_mpc
@@ -0,0 +1,233 @@
+// Copyright (C) 2020 Jorgen S. Dokken
+//
+// This file is part of DOLFINX_MPC
+//
+// SPDX-License-Identifier:    LGPL-3.0-or-later
+
+#include "assemble_vector.h"
+#include <dolfinx/common/Timer.h>
+#include <dolfinx/fem/DofMap.h>
+#include <dolfinx/fem/FormIntegrals.h>
+#include <dolfinx/fem/utils.h>
+#include <dolfinx/function/FunctionSpace.h>
+#include <dolfinx/graph/AdjacencyList.h>
+#include <dolfinx/mesh/Mesh.h>
+#include <vector>
+
+namespace
+{
+using VectorXscalar = Eigen::Matrix<PetscScalar, Eigen::Dynamic, 1>;
+
+/// Apply the multi-point constraint to the element vector of a slave
+/// cell: the slave entries of be are zeroed in place and their values,
+/// weighted by the constraint coefficients, are added to b at the
+/// master dofs
+void modify_mpc_cell(
+    Eigen::Ref<VectorXscalar> b, const int num_dofs,
+    Eigen::Ref<VectorXscalar> be,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& cell_dofs,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& slaves,
+    const dolfinx::graph::AdjacencyList<std::int32_t>& masters,
+    const Eigen::Array<PetscScalar, Eigen::Dynamic, 1>& coefficients,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& offsets,
+    const Eigen::Array<std::int32_t, Eigen::Dynamic, 1>& cell_slaves)
+{
+  for (std::int32_t i = 0; i < cell_slaves.rows(); ++i)
+  {
+    const std::int32_t slave_index = cell_slaves[i];
+
+    // Local position of the slave dof within the cell dofs
+    int local = -1;
+    for (int k = 0; k < num_dofs; ++k)
+    {
+      if (cell_dofs[k] == slaves[slave_index])
+      {
+        local = k;
+        break;
+      }
+    }
+    assert(local != -1);
+    const PetscScalar slave_value = be[local];
+
+    auto cell_masters = masters.links(slave_index);
+    for (std::int32_t m = 0; m < cell_masters.rows(); ++m)
+    {
+      b[cell_masters[m]]
+          += coefficients[offsets[slave_index] + m] * slave_value;
+    }
+    // The slave entry must not be inserted
+    be[local] = 0.0;
+  }
+}
+} // namespace
+
+//-----------------------------------------------------------------------------
+void dolfinx_mpc::assemble_vector(
+    Eigen::Ref<Eigen::Matrix<PetscScalar, Eigen::Dynamic, 1>> b,
+    const dolfinx::fem::Form<PetscScalar>& L,
+    const std::shared_ptr<MultiPointConstraint>& mpc)
+{
+  dolfinx::common::Timer timer("~MPC: Assemble vector (C++)");
+  if (L.rank() != 1)
+  {
+    throw std::runtime_error(
+        "Cannot assemble vector. Form is not a linear form");
+  }
+
+  // Mesh and geometry data
+  std::shared_ptr<const dolfinx::mesh::Mesh> mesh = L.mesh();
+  assert(mesh);
+  const int gdim = mesh->geometry().dim();
+  const int tdim = mesh->topology().dim();
+  const dolfinx::graph::AdjacencyList<std::int32_t>& x_dofmap
+      = mesh->geometry().dofmap();
+  const Eigen::Array<double, Eigen::Dynamic, 3, Eigen::RowMajor>& x_g
+      = mesh->geometry().x();
+
+  // Dofmap data
+  const dolfinx::fem::DofMap& dofmap = *L.function_space(0)->dofmap();
+  const dolfinx::graph::AdjacencyList<std::int32_t>& dofs = dofmap.list();
+  const int num_dofs_per_element = dofmap.element_dof_layout->num_dofs()
+                                   * dofmap.element_dof_layout->block_size();
+
+  // Pack form coefficients and constants
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, Eigen::Dynamic,
+                     Eigen::RowMajor>
+      coeffs = dolfinx::fem::pack_coefficients(L);
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, 1> constants
+      = dolfinx::fem::pack_constants(L);
+
+  // Unpack MPC data
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> slave_cells
+      = mpc->slave_cells();
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> slaves = mpc->slaves();
+  std::shared_ptr<dolfinx::graph::AdjacencyList<std::int32_t>> cell_to_slaves
+      = mpc->cell_to_slaves();
+  std::shared_ptr<dolfinx::graph::AdjacencyList<std::int32_t>> masters
+      = mpc->masters_local();
+  const Eigen::Array<PetscScalar, Eigen::Dynamic, 1> coefficients
+      = mpc->coefficients();
+  const Eigen::Array<std::int32_t, Eigen::Dynamic, 1> offsets
+      = masters->offsets();
+
+  // Map from cell to index in slave_cells (-1 for cells without slaves)
+  std::vector<std::int32_t> cell_to_slave_cell(dofs.num_nodes(), -1);
+  for (std::int32_t i = 0; i < slave_cells.rows(); ++i)
+    cell_to_slave_cell[slave_cells[i]] = i;
+
+  const int num_dofs_g = x_dofmap.num_links(0);
+  Eigen::Array<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>
+      coordinate_dofs(num_dofs_g, gdim);
+  VectorXscalar be(num_dofs_per_element);
+
+  const dolfinx::fem::FormIntegrals<PetscScalar>& integrals = L.integrals();
+  if (integrals.num_integrals(dolfinx::fem::IntegralType::interior_facet) > 0)
+  {
+    throw std::runtime_error(
+        "Interior facet integrals not supported in MPC assembly");
+  }
+
+  // Assemble over cells
+  if (integrals.num_integrals(dolfinx::fem::IntegralType::cell) > 0)
+    mesh->topology_mutable().create_entity_permutations();
+  for (int i = 0;
+       i < integrals.num_integrals(dolfinx::fem::IntegralType::cell); ++i)
+  {
+    const auto& fn
+        = integrals.get_tabulate_tensor(dolfinx::fem::IntegralType::cell, i);
+    const std::vector<std::int32_t>& active_cells
+        = integrals.integral_domains(dolfinx::fem::IntegralType::cell, i);
+    const Eigen::Array<std::uint32_t, Eigen::Dynamic, 1>& cell_perms
+        = mesh->topology().get_cell_permutation_info();
+
+    for (std::int32_t cell : active_cells)
+    {
+      // Gather cell geometry
+      auto x_dofs = x_dofmap.links(cell);
+      for (int j = 0; j < num_dofs_g; ++j)
+        coordinate_dofs.row(j) = x_g.row(x_dofs[j]).head(gdim);
+
+      be.setZero();
+      fn(be.data(), coeffs.row(cell).data(), constants.data(),
+         coordinate_dofs.data(), nullptr, nullptr, cell_perms[cell]);
+
+      auto cell_dofs = dofs.links(cell);
+      const std::int32_t slave_cell = cell_to_slave_cell[cell];
+      if (slave_cell != -1)
+      {
+        modify_mpc_cell(b, num_dofs_per_element, be, cell_dofs, slaves,
+                        *masters, coefficients, offsets,
+                        cell_to_slaves->links(slave_cell));
+      }
+      for (int k = 0; k < num_dofs_per_element; ++k)
+        b[cell_dofs[k]] += be[k];
+    }
+  }
+
+  // Assemble over exterior facets
+  if (integrals.num_integrals(dolfinx::fem::IntegralType::exterior_facet) > 0)
+  {
+    mesh->topology_mutable().create_entities(tdim - 1);
+    mesh->topology_mutable().create_connectivity(tdim - 1, tdim);
+    mesh->topology_mutable().create_entity_permutations();
+  }
+  for (int i = 0;
+       i < integrals.num_integrals(dolfinx::fem::IntegralType::exterior_facet);
+       ++i)
+  {
+    const auto& fn = integrals.get_tabulate_tensor(
+        dolfinx::fem::IntegralType::exterior_facet, i);
+    const std::vector<std::int32_t>& active_facets
+        = integrals.integral_domains(
+            dolfinx::fem::IntegralType::exterior_facet, i);
+    const Eigen::Array<std::uint32_t, Eigen::Dynamic, 1>& cell_perms
+        = mesh->topology().get_cell_permutation_info();
+    const Eigen::Array<std::uint8_t, Eigen::Dynamic, Eigen::Dynamic>&
+        facet_perms
+        = mesh->topology().get_facet_permutations();
+    auto f_to_c = mesh->topology().connectivity(tdim - 1, tdim);
+    auto c_to_f = mesh->topology().connectivity(tdim, tdim - 1);
+    assert(f_to_c);
+    assert(c_to_f);
+
+    for (std::int32_t facet : active_facets)
+    {
+      assert(f_to_c->num_links(facet) == 1);
+      const std::int32_t cell = f_to_c->links(facet)[0];
+
+      // Local index of the facet within the cell
+      auto cell_facets = c_to_f->links(cell);
+      int local_facet = 0;
+      for (int j = 0; j < cell_facets.rows(); ++j)
+      {
+        if (cell_facets[j] == facet)
+        {
+          local_facet = j;
+          break;
+        }
+      }
+
+      // Gather cell geometry
+      auto x_dofs = x_dofmap.links(cell);
+      for (int j = 0; j < num_dofs_g; ++j)
+        coordinate_dofs.row(j) = x_g.row(x_dofs[j]).head(gdim);
+
+      be.setZero();
+      const std::uint8_t perm = facet_perms(local_facet, cell);
+      fn(be.data(), coeffs.row(cell).data(), constants.data(),
+         coordinate_dofs.data(), &local_facet, &perm, cell_perms[cell]);
+
+      auto cell_dofs = dofs.links(cell);
+      const std::int32_t slave_cell = cell_to_slave_cell[cell];
+      if (slave_cell != -1)
+      {
+        modify_mpc_cell(b, num_dofs_per_element, be, cell_dofs, slaves,
+                        *masters, coefficients, offsets,
+                        cell_to_slaves->links(slave_cell));
+      }
+      for (int k = 0; k < num_dofs_per_element; ++k)
+        b[cell_dofs[k]] += be[k];
+    }
+  }
+}
+//-----------------------------------------------------------------------------
@@ -0,0 +1,32 @@
+// Copyright (C) 2020 Jorgen S. Dokken
+//
+// This file is part of DOLFINX_MPC
+//
+// SPDX-License-Identifier:    LGPL-3.0-or-later
+
+#pragma once
+
+#include "MultiPointConstraint.h"
+#include <Eigen/Dense>
+#include <dolfinx/fem/Form.h>
+#include <petscsys.h>
+
+namespace dolfinx_mpc
+{
+
+/// Assemble a linear form into a local vector, applying the
+/// multi-point constraint in the same pass: every element vector is
+/// tabulated once, its slave entries are moved to the corresponding
+/// masters weighted by the constraint coefficients, and the result is
+/// scattered into b. Only cell and exterior facet integrals are
+/// supported, mirroring the numba assembler in the Python layer.
+///
+/// @param[in,out] b The local vector to assemble into
+/// @param[in] L The linear form
+/// @param[in] mpc The multi-point constraint
+void assemble_vector(
+    Eigen::Ref<Eigen::Matrix<PetscScalar, Eigen::Dynamic, 1>> b,
+    const dolfinx::fem::Form<PetscScalar>& L,
+    const std::shared_ptr<MultiPointConstraint>& mpc);
+
+} // namespace dolfinx_mpc
@@ -2,4 +2,6 @@
 
 // DOLFINX_MPC interface
 #include <MultiPointConstraint.h>
+#include <assemble_matrix.h>
+#include <assemble_vector.h>
 #include <utils.h>
\ No newline at end of file
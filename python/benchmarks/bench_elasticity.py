@@ -25,13 +25,15 @@ from mpi4py import MPI
 
 
 def bench_elasticity_one(out_xdmf=None, r_lvl=0, out_hdf5=None,
-                         xdmf=False, boomeramg=False, kspview=False):
-    N = 3
-    mesh = dolfinx.UnitCubeMesh(MPI.COMM_WORLD, N, N, N)
-    for i in range(r_lvl):
-        # dolfinx.log.set_log_level(dolfinx.log.LogLevel.INFO)
-        mesh = dolfinx.mesh.refine(mesh, redistribute=True)
-        # dolfinx.log.set_log_level(dolfinx.log.LogLevel.ERROR)
+                         xdmf=False, boomeramg=False, kspview=False,
+                         mesh=None):
+    # Build the mesh from scratch if the caller has not supplied a
+    # (pre-refined) mesh
+    if mesh is None:
+        N = 3
+        mesh = dolfinx.UnitCubeMesh(MPI.COMM_WORLD, N, N, N)
+        for i in range(r_lvl):
+            mesh = dolfinx.mesh.refine(mesh, redistribute=True)
 
     fdim = mesh.topology.dim - 1
     V = dolfinx.VectorFunctionSpace(mesh, ("Lagrange", 1))
@@ -42,7 +44,9 @@ def bench_elasticity_one(out_xdmf=None, r_lvl=0, out_hdf5=None,
         u_local.set(0.0)
 
     def boundaries(x):
-        return np.isclose(x[0], np.finfo(float).eps)
+        # Single fused comparison instead of np.isclose, which
+        # evaluates atol + rtol*|b| and allocates intermediates
+        return np.abs(x[0]) < 1e-8
     facets = dolfinx.mesh.locate_entities_boundary(mesh, fdim,
                                                    boundaries)
     topological_dofs = dolfinx.fem.locate_dofs_topological(V, fdim, facets)
@@ -51,7 +55,7 @@ def bench_elasticity_one(out_xdmf=None, r_lvl=0, out_hdf5=None,
 
     # Create traction meshtag
     def traction_boundary(x):
-        return np.isclose(x[0], 1)
+        return np.abs(x[0] - 1.0) < 1e-8
     t_facets = dolfinx.mesh.locate_entities_boundary(mesh, fdim,
                                                      traction_boundary)
     facet_values = np.ones(len(t_facets), dtype=np.int32)
@@ -98,28 +102,27 @@ def bench_elasticity_one(out_xdmf=None, r_lvl=0, out_hdf5=None,
     b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES,
                   mode=PETSc.ScatterMode.REVERSE)
     dolfinx.fem.set_bc(b, bcs)
-    # Apply boundary conditions
-    dolfinx.fem.apply_lifting(b, [a], [bcs])
-    b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES,
-                  mode=PETSc.ScatterMode.REVERSE)
-    dolfinx.fem.set_bc(b, bcs)
 
     # Create functionspace and function for mpc vector
 
     # Solve Linear problem
     solver = PETSc.KSP().create(MPI.COMM_WORLD)
+    # Configure solver and preconditioner through the direct petsc4py
+    # API where one exists; only sub-solver options without setters go
+    # through the string-keyed options database
+    pc = solver.getPC()
     opts = PETSc.Options()
     if boomeramg:
-        opts["ksp_type"] = "cg"
-        opts["ksp_rtol"] = 1.0e-5
-        opts["pc_type"] = "hypre"
-        opts['pc_hypre_type'] = 'boomeramg'
+        solver.setType("cg")
+        solver.setTolerances(rtol=1.0e-5)
+        pc.setType("hypre")
+        pc.setHYPREType("boomeramg")
         opts["pc_hypre_boomeramg_max_iter"] = 1
         opts["pc_hypre_boomeramg_cycle_type"] = "v"
         # opts["pc_hypre_boomeramg_print_statistics"] = 1
     else:
-        opts["ksp_rtol"] = 1.0e-10
-        opts["pc_type"] = "gamg"
+        solver.setTolerances(rtol=1.0e-10)
+        pc.setType("gamg")
         opts["pc_gamg_type"] = "agg"
         opts["pc_gamg_coarse_eq_limit"] = 1000
         opts["pc_gamg_sym_graph"] = True
@@ -215,15 +218,20 @@ if __name__ == "__main__":
     solver = "BoomerAMG" if boomeramg else "GAMG"
     sd.attrs["solver"] = np.string_(solver)
 
-    # Loop over refinement levels
+    # Loop over refinement levels, refining the mesh incrementally so
+    # level i does not redo the refinements of levels 0..i-1
+    mesh = dolfinx.UnitCubeMesh(MPI.COMM_WORLD, 3, 3, 3)
     for i in range(N):
+        if i > 0:
+            mesh = dolfinx.mesh.refine(mesh, redistribute=True)
         if MPI.COMM_WORLD.rank == 0:
             dolfinx.log.set_log_level(dolfinx.log.LogLevel.INFO)
             dolfinx.log.log(dolfinx.log.LogLevel.INFO,
                             "Run {0:1d} in progress".format(i))
             dolfinx.log.set_log_level(dolfinx.log.LogLevel.ERROR)
         bench_elasticity_one(r_lvl=i, out_hdf5=h5f, xdmf=xdmf,
-                             boomeramg=boomeramg, kspview=kspview)
+                             boomeramg=boomeramg, kspview=kspview,
+                             mesh=mesh)
         if timings and i == N-1:
             dolfinx.common.list_timings(
                 MPI.COMM_WORLD, [dolfinx.common.TimingType.wall])
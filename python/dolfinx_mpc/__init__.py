@@ -7,9 +7,24 @@
 
 # flake8: noqa
 
-import dolfinx_mpc.cpp
+import importlib
 
-# New local assemblies
-from .assemble_matrix import assemble_matrix
-from .assemble_vector import assemble_vector
-from .multipointconstraint import MultiPointConstraint
+# Map of public names to the submodules providing them. The submodules
+# (which pull in numba and the compiled extension) are imported on
+# first attribute access (PEP 562), so scripts that do not assemble
+# anything avoid the numba/LLVM startup cost.
+_submodule_of = {"assemble_matrix": "assemble_matrix",
+                 "assemble_vector": "assemble_vector",
+                 "MultiPointConstraint": "multipointconstraint"}
+
+
+def __getattr__(name):
+    if name == "cpp":
+        return importlib.import_module("dolfinx_mpc.cpp")
+    if name in _submodule_of:
+        module = importlib.import_module("." + _submodule_of[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {0:s} has no attribute {1:s}".format(
+        __name__, name))
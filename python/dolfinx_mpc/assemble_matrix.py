@@ -5,27 +5,58 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 import numba
 import numpy
+from numba.experimental import jitclass
 
 import dolfinx
 import dolfinx.common
 import dolfinx.log
+import dolfinx_mpc.cpp
 
 from .numba_setup import PETSc, ffi, mode, set_values_local, sink
 
 Timer = dolfinx.common.Timer
 
-
-@numba.njit(cache=True)
-def in_numpy_array(array, value):
+# Compiled forms and their extracted tabulation kernels, keyed on the
+# form signature. For repeated assembly (time stepping, Newton
+# iterations) this avoids the ffcx_jit roundtrip and the per-integral
+# kernel extraction on every call; the numba kernels specialized on
+# these function pointers are then reused as well
+_ufc_form_cache = {}
+_tabulate_kernel_cache = {}
+
+
+_mpc_data_spec = [
+    ("slaves", numba.types.int32[:]),
+    ("masters_local", numba.types.int32[:]),
+    ("coefficients", numba.from_dtype(numpy.dtype(PETSc.ScalarType))[:]),
+    ("offsets", numba.types.int32[:]),
+    ("slave_cells", numba.types.int32[:]),
+    ("cell_to_slave", numba.types.int32[:]),
+    ("cell_to_slave_offsets", numba.types.int32[:]),
+    ("cell_slave_local", numba.types.int32[:]),
+]
+
+
+@jitclass(_mpc_data_spec)
+class MPCData:
     """
-    Convenience function replacing "value in array" for numpy arrays in numba
+    Structure-of-arrays container for the multi point constraint data
+    used by the assembly kernels. Attribute access compiles to direct
+    loads, unlike a heterogeneous tuple, which numba unpacks on every
+    use
     """
-    in_array = False
-    for item in array:
-        if item == value:
-            in_array = True
-            break
-    return in_array
+
+    def __init__(self, slaves, masters_local, coefficients, offsets,
+                 slave_cells, cell_to_slave, cell_to_slave_offsets,
+                 cell_slave_local):
+        self.slaves = slaves
+        self.masters_local = masters_local
+        self.coefficients = coefficients
+        self.offsets = offsets
+        self.slave_cells = slave_cells
+        self.cell_to_slave = cell_to_slave
+        self.cell_to_slave_offsets = cell_to_slave_offsets
+        self.cell_slave_local = cell_slave_local
 
 
 def pack_facet_info(mesh, integrals, i):
@@ -49,6 +80,26 @@ def pack_facet_info(mesh, integrals, i):
     return facet_info
 
 
+@numba.njit(cache=True)
+def compute_cell_slave_local(slave_cells, dofmap, slaves,
+                             cell_to_slave, c_to_s_off):
+    """
+    For each slave on each slave cell, compute the position of the
+    slave dof within the cell dofs. The result is aligned with
+    cell_to_slave, so the assembly kernels can slice it instead of
+    rescanning the cell dofs
+    """
+    cell_slave_local = numpy.zeros(len(cell_to_slave), dtype=numpy.int32)
+    for i in range(len(slave_cells)):
+        cell_dofs = dofmap[slave_cells[i]]
+        for j in range(c_to_s_off[i], c_to_s_off[i+1]):
+            # argmax of the boolean comparison compiles to a single
+            # vectorized scan over the cell dofs
+            cell_slave_local[j] = numpy.argmax(
+                cell_dofs == slaves[cell_to_slave[j]])
+    return cell_slave_local
+
+
 @numba.njit(fastmath=True, cache=True)
 def pack_facet_info_numba(active_facets, c_to_f, f_to_c):
     facet_info = numpy.zeros((len(active_facets), 2),
@@ -59,19 +110,26 @@ def pack_facet_info_numba(active_facets, c_to_f, f_to_c):
     for j, facet in enumerate(active_facets):
         cells = f_to_c_pos[f_to_c_offs[facet]:f_to_c_offs[facet+1]]
         assert(len(cells) == 1)
-        local_facets = c_to_f_pos[c_to_f_offs[cells[0]]:
-                                  c_to_f_offs[cells[0]+1]]
-        # Should be wrapped in convenience numba function
-        local_index = numpy.flatnonzero(facet == local_facets)[0]
-        facet_info[j, :] = [cells[0], local_index]
+        cell = cells[0]
+        for k in range(c_to_f_offs[cell], c_to_f_offs[cell+1]):
+            if c_to_f_pos[k] == facet:
+                facet_info[j, 0] = cell
+                facet_info[j, 1] = k - c_to_f_offs[cell]
+                break
     return facet_info
 
 
-def assemble_matrix(form, constraint, bcs=[]):
+def assemble_matrix(form, constraint, bcs=[], A=None, backend=None):
     """
     Assembles a ufl form given a multi point constraint and possible
     Dirichlet boundary conditions.
     NOTE: Dirichlet conditions cant be on master dofs.
+    A matrix from a previous assembly with the same form and constraint
+    can be passed in as A to reuse its sparsity pattern and
+    preallocation.
+    The backend keyword selects the MPC assembler: "cpp" for the
+    compiled extension, "numba" for the JIT kernels, or None (default)
+    to use the compiled assembler when the extension provides it.
     """
     timer_matrix = Timer("~MPC: Assemble matrix")
 
@@ -79,124 +137,207 @@ def assemble_matrix(form, constraint, bcs=[]):
     assert(form.arguments()[0].ufl_function_space() ==
            form.arguments()[1].ufl_function_space())
     V = form.arguments()[0].ufl_function_space()
-    dofmap = V.dofmap
-    dofs = dofmap.list.array
-
-    # Unravel data from MPC
-    slave_cells = constraint.slave_cells()
-    coefficients = constraint.coefficients()
-    masters = constraint.masters_local()
-    slave_cell_to_dofs = constraint.cell_to_slaves()
-    cell_to_slave = slave_cell_to_dofs.array
-    c_to_s_off = slave_cell_to_dofs.offsets
+
     slaves_local = constraint.slaves()
     num_local_slaves = constraint.num_local_slaves()
-    masters_local = masters.array
-    offsets = masters.offsets
-    mpc_data = (slaves_local, masters_local, coefficients, offsets,
-                slave_cells, cell_to_slave, c_to_s_off)
 
     # Gather BC data
-    bc_array = numpy.array([])
     local_slave_dofs_trimmed = slaves_local[:num_local_slaves]
     bc_mpc = [dolfinx.DirichletBC(
         dolfinx.Function(V), local_slave_dofs_trimmed)]
 
+    # Concatenate the local indices (of possible sub spaces) of all
+    # Dirichlet dofs in one go instead of growing the array per bc
     if len(bcs) > 0:
         bc_mpc.extend(bcs)
-        for bc in bcs:
-            # Extract local index of possible sub space
-            bc_array = numpy.append(bc_array, bc.dof_indices[:, 0])
-
-    # Get data from mesh
-    pos = V.mesh.geometry.dofmap.offsets
-    x_dofs = V.mesh.geometry.dofmap.array
-    x = V.mesh.geometry.x
-
-    # Generate ufc_form
-    ufc_form = dolfinx.jit.ffcx_jit(form)
+        bc_array = numpy.concatenate(
+            [bc.dof_indices[:, 0] for bc in bcs]).astype(numpy.int32)
+    else:
+        bc_array = numpy.zeros(0, dtype=numpy.int32)
 
     # Generate matrix with MPC sparsity pattern
     cpp_form = dolfinx.Form(form)._cpp_object
 
-    # Pack constants and coefficients
-    form_coeffs = dolfinx.cpp.fem.pack_coefficients(cpp_form)
-    form_consts = dolfinx.cpp.fem.pack_constants(cpp_form)
-
-    # Create sparsity pattern
-    pattern = constraint.create_sparsity_pattern(cpp_form)
-    pattern.assemble()
-    with Timer("~MPC: Assemble matrix (Create matrix)"):
-        A = dolfinx.cpp.la.create_matrix(V.mesh.mpi_comm(), pattern)
-        A.zeroEntries()
+    # Create sparsity pattern and matrix, unless a matrix with a
+    # matching pattern is reused from an earlier assembly
+    if A is None:
+        pattern = constraint.create_sparsity_pattern(cpp_form)
+        pattern.assemble()
+        with Timer("~MPC: Assemble matrix (Create matrix)"):
+            A = dolfinx.cpp.la.create_matrix(V.mesh.mpi_comm(), pattern)
+    A.zeroEntries()
+    # The MPC sparsity pattern covers all cross-master pairs and
+    # (cell dof, master) couplings of every slave cell. Any insertion
+    # outside the preallocation would make PETSc reallocate inside
+    # MatSetValues, which is orders of magnitude slower per entry, so
+    # turn such insertions into an error instead
+    A.setOption(PETSc.Mat.Option.NEW_NONZERO_ALLOCATION_ERR, True)
 
     # Assemble the matrix with all entries
     with Timer("~MPC: Assemble matrix (classical components)"):
         dolfinx.cpp.fem.assemble_matrix_petsc(A, cpp_form, bcs)
 
-    # General assembly data
-    num_dofs_per_element = (dofmap.dof_layout.num_dofs *
-                            dofmap.dof_layout.block_size())
-
-    gdim = V.mesh.geometry.dim
-    tdim = V.mesh.topology.dim
-
-    # Get integrals as FormIntegral
-    formintegral = cpp_form.integrals
-
-    # Assemble over cells
-    subdomain_ids = formintegral.integral_ids(
-        dolfinx.fem.IntegralType.cell)
-    num_cell_integrals = len(subdomain_ids)
-
-    if num_cell_integrals > 0:
-        V.mesh.topology.create_entity_permutations()
-        permutation_info = V.mesh.topology.get_cell_permutation_info()
-
-    for i in range(num_cell_integrals):
-        subdomain_id = subdomain_ids[i]
-        with Timer("~MPC: Assemble matrix (cell kernel)"):
-            cell_kernel = ufc_form.create_cell_integral(
-                subdomain_id).tabulate_tensor
-        active_cells = numpy.array(formintegral.integral_domains(
-            dolfinx.fem.IntegralType.cell, i), dtype=numpy.int64)
-        slave_cell_indices = numpy.flatnonzero(
-            numpy.isin(active_cells, slave_cells))
-        with Timer("~MPC: Assemble matrix (numba cells)"):
-            assemble_cells(A.handle, cell_kernel,
-                           active_cells[slave_cell_indices],
-                           (pos, x_dofs, x),
-                           gdim, form_coeffs, form_consts,
-                           permutation_info,
-                           dofs, num_dofs_per_element, mpc_data,
-                           bc_array)
-
-    # Assemble over exterior facets
-    subdomain_ids = formintegral.integral_ids(
-        dolfinx.fem.IntegralType.exterior_facet)
-    num_exterior_integrals = len(subdomain_ids)
-
-    # Get cell orientation data
-    if num_exterior_integrals > 0:
-        V.mesh.topology.create_entities(tdim - 1)
-        V.mesh.topology.create_connectivity(tdim - 1, tdim)
-        permutation_info = V.mesh.topology.get_cell_permutation_info()
-        facet_permutation_info = V.mesh.topology.get_facet_permutations()
-        perm = (permutation_info, facet_permutation_info)
-    for j in range(num_exterior_integrals):
-        facet_info = pack_facet_info(V.mesh, formintegral, j)
-
-        subdomain_id = subdomain_ids[j]
-        with Timer("~MPC: Assemble matrix (ext. facet kernel)"):
-            facet_kernel = ufc_form.create_exterior_facet_integral(
-                subdomain_id).tabulate_tensor
-        with Timer("~MPC: Assemble matrix (numba ext. facet)"):
-            assemble_exterior_facets(A.handle, facet_kernel,
-                                     (pos, x_dofs, x), gdim,
-                                     form_coeffs, form_consts,
-                                     perm, dofs, num_dofs_per_element,
-                                     facet_info, mpc_data,
-                                     bc_array)
+    # Assemble the MPC contributions with the compiled C++ assembler
+    # or the numba kernels. All numba-only setup stays in the numba
+    # branch so the compiled path does not pay for JIT warm-up
+    cpp_assembler = getattr(dolfinx_mpc.cpp.mpc, "assemble_matrix", None)
+    if backend is None:
+        backend = "cpp" if cpp_assembler is not None else "numba"
+    if backend == "cpp":
+        if cpp_assembler is None:
+            raise RuntimeError(
+                "Compiled MPC matrix assembler not available")
+        cpp_assembler(A, cpp_form, constraint._cpp_object, bc_array)
+    elif backend == "numba":
+        dofmap = V.dofmap
+        dofs = dofmap.list.array
+        num_dofs_per_element = (dofmap.dof_layout.num_dofs *
+                                dofmap.dof_layout.block_size())
+
+        # Unravel data from MPC
+        slave_cells = constraint.slave_cells()
+        coefficients = constraint.coefficients()
+        masters = constraint.masters_local()
+        slave_cell_to_dofs = constraint.cell_to_slaves()
+        cell_to_slave = slave_cell_to_dofs.array
+        c_to_s_off = slave_cell_to_dofs.offsets
+        masters_local = masters.array
+        offsets = masters.offsets
+        # Pre-invert the slave -> cell-dof map: aligned with
+        # cell_to_slave, cell_slave_local holds the position of each
+        # cell slave within the cell dofs, so the kernels slice instead
+        # of rescanning the cell dofs for every slave on every cell
+        dofs_2d = dofs.reshape(-1, num_dofs_per_element)
+        cell_slave_local = compute_cell_slave_local(
+            slave_cells, dofs_2d, slaves_local, cell_to_slave, c_to_s_off)
+
+        mpc_data = MPCData(slaves_local, masters_local, coefficients,
+                           offsets, slave_cells, cell_to_slave, c_to_s_off,
+                           cell_slave_local)
+
+        # Largest per-cell slave and master counts, used by the kernels
+        # to preallocate the block-insertion scratch once instead of
+        # per cell
+        if len(slave_cells) > 0:
+            max_slaves_per_cell = int(numpy.max(numpy.diff(c_to_s_off)))
+            max_masters_per_cell = int(numpy.max(numpy.add.reduceat(
+                numpy.diff(offsets)[cell_to_slave], c_to_s_off[:-1])))
+        else:
+            max_slaves_per_cell = 0
+            max_masters_per_cell = 0
+        scratch_sizes = (max_slaves_per_cell, max_masters_per_cell)
+
+        # Hash the slave cells once, so that the assembly kernels can
+        # map a cell index to its slave-cell index in O(1) instead of
+        # scanning slave_cells for every cell
+        slave_cell_map = numba.typed.Dict.empty(numba.types.int64,
+                                                numba.types.int64)
+        for i, cell in enumerate(slave_cells):
+            slave_cell_map[cell] = i
+
+        # Hashed counterpart of bc_array for O(1) lookups in the
+        # kernels
+        bc_dofs = numba.typed.Dict.empty(numba.types.int64,
+                                         numba.types.int8)
+        for dof in bc_array:
+            bc_dofs[numpy.int64(dof)] = 1
+
+        # Get data from mesh
+        pos = V.mesh.geometry.dofmap.offsets
+        x_dofs = V.mesh.geometry.dofmap.array
+        x = V.mesh.geometry.x
+        # All cells are assumed to be of the same type, so the geometry
+        # dofmap is handed to the kernels as a 2D (cell, vertex) view
+        # without the offset indirection
+        num_vertices_per_cell = pos[1] - pos[0]
+        x_dofs_2d = x_dofs.reshape(-1, num_vertices_per_cell)
+
+        # Generate ufc_form, reusing an earlier compilation of the
+        # same form
+        form_signature = form.signature()
+        ufc_form = _ufc_form_cache.get(form_signature)
+        if ufc_form is None:
+            ufc_form = dolfinx.jit.ffcx_jit(form)
+            _ufc_form_cache[form_signature] = ufc_form
+
+        # Pack constants and coefficients
+        form_coeffs = dolfinx.cpp.fem.pack_coefficients(cpp_form)
+        form_consts = dolfinx.cpp.fem.pack_constants(cpp_form)
+
+        # General assembly data
+        gdim = V.mesh.geometry.dim
+        tdim = V.mesh.topology.dim
+
+        # Get integrals as FormIntegral
+        formintegral = cpp_form.integrals
+
+        # Assemble over cells
+        subdomain_ids = formintegral.integral_ids(
+            dolfinx.fem.IntegralType.cell)
+        num_cell_integrals = len(subdomain_ids)
+
+        if num_cell_integrals > 0:
+            V.mesh.topology.create_entity_permutations()
+            permutation_info = V.mesh.topology.get_cell_permutation_info()
+
+        for i in range(num_cell_integrals):
+            subdomain_id = subdomain_ids[i]
+            kernel_key = (form_signature, "cell", subdomain_id)
+            cell_kernel = _tabulate_kernel_cache.get(kernel_key)
+            if cell_kernel is None:
+                with Timer("~MPC: Assemble matrix (cell kernel)"):
+                    cell_kernel = ufc_form.create_cell_integral(
+                        subdomain_id).tabulate_tensor
+                _tabulate_kernel_cache[kernel_key] = cell_kernel
+            active_cells = numpy.array(formintegral.integral_domains(
+                dolfinx.fem.IntegralType.cell, i), dtype=numpy.int64)
+            slave_cell_indices = numpy.flatnonzero(
+                numpy.isin(active_cells, slave_cells))
+            with Timer("~MPC: Assemble matrix (numba cells)"):
+                assemble_cells(A.handle, cell_kernel,
+                               active_cells[slave_cell_indices],
+                               (x_dofs_2d, x),
+                               gdim, int(num_vertices_per_cell),
+                               form_coeffs, form_consts,
+                               permutation_info,
+                               dofs_2d, num_dofs_per_element, mpc_data,
+                               slave_cell_map, bc_dofs, scratch_sizes)
+
+        # Assemble over exterior facets
+        subdomain_ids = formintegral.integral_ids(
+            dolfinx.fem.IntegralType.exterior_facet)
+        num_exterior_integrals = len(subdomain_ids)
+
+        # Get cell orientation data
+        if num_exterior_integrals > 0:
+            V.mesh.topology.create_entities(tdim - 1)
+            V.mesh.topology.create_connectivity(tdim - 1, tdim)
+            permutation_info = V.mesh.topology.get_cell_permutation_info()
+            facet_permutation_info = V.mesh.topology.get_facet_permutations()
+            perm = (permutation_info, facet_permutation_info)
+        for j in range(num_exterior_integrals):
+            facet_info = pack_facet_info(V.mesh, formintegral, j)
+
+            subdomain_id = subdomain_ids[j]
+            kernel_key = (form_signature, "exterior_facet", subdomain_id)
+            facet_kernel = _tabulate_kernel_cache.get(kernel_key)
+            if facet_kernel is None:
+                with Timer("~MPC: Assemble matrix (ext. facet kernel)"):
+                    facet_kernel = ufc_form.create_exterior_facet_integral(
+                        subdomain_id).tabulate_tensor
+                _tabulate_kernel_cache[kernel_key] = facet_kernel
+            with Timer("~MPC: Assemble matrix (numba ext. facet)"):
+                assemble_exterior_facets(A.handle, facet_kernel,
+                                         (x_dofs_2d, x), gdim,
+                                         int(num_vertices_per_cell),
+                                         form_coeffs, form_consts,
+                                         perm, dofs_2d, num_dofs_per_element,
+                                         facet_info, mpc_data,
+                                         slave_cell_map, bc_dofs,
+                                         scratch_sizes)
+    else:
+        raise RuntimeError(
+            "Unknown MPC assembly backend {0:s}".format(backend))
 
     with Timer("~MPC: Assemble matrix (diagonal handling)"):
         # Add one on diagonal for diriclet bc and slave dofs
@@ -211,304 +352,340 @@ def assemble_matrix(form, constraint, bcs=[]):
     return A
 
 
-@numba.njit
-def assemble_cells(A, kernel, active_cells, mesh, gdim, coeffs, constants,
-                   permutation_info, dofmap,
-                   num_dofs_per_element, mpc, bcs):
+@numba.njit(cache=True)
+def pack_mpc_scratch(num_dofs_per_element, scratch_sizes):
     """
-    Assemble MPC contributions for cell integrals
+    Preallocate the index and value buffers (and their CFFI handles)
+    used for the per-cell MPC block insertion, sized for the largest
+    slave cell, so they are reused for every cell
     """
+    max_slaves, max_masters = scratch_sizes
+    max_block = num_dofs_per_element + max_masters
+    block_pos = numpy.zeros(max_block, dtype=numpy.int32)
+    block_vals = numpy.zeros(max_block*max_block, dtype=PETSc.ScalarType)
+    master_offset = numpy.zeros(max_slaves + 1, dtype=numpy.int32)
+    is_slave = numpy.zeros(num_dofs_per_element, dtype=numpy.int8)
+    return (block_pos, block_vals, master_offset, is_slave,
+            ffi.from_buffer(block_pos), ffi.from_buffer(block_vals))
+
+
+# NOTE: The assembly kernels take the compiled tabulation kernel as a
+# function pointer, which numba cannot cache on disk
+@numba.njit(parallel=True, fastmath=True, boundscheck=False,
+            error_model='numpy')
+def assemble_cells(A, kernel, active_cells, mesh, gdim, num_vertices,
+                   coeffs, constants, permutation_info, dofmap,
+                   num_dofs_per_element, mpc, slave_cell_map, bc_dofs,
+                   scratch_sizes):
+    """
+    Assemble MPC contributions for cell integrals.
+    The element tensors and MPC blocks of all cells are computed in a
+    parallel loop into per-cell buffers; MatSetValuesLocal is not
+    thread-safe, so the collected contributions are flushed to PETSc in
+    a second, serial pass.
+    """
+    # Specialize the compiled kernel on the element sizes, so the inner
+    # loops get compile-time trip counts and can be unrolled
+    numba.literally(num_dofs_per_element)
+    numba.literally(gdim)
+    numba.literally(num_vertices)
     ffi_fb = ffi.from_buffer
 
     # Get mesh and geometry data
-    pos, x_dofmap, x = mesh
-
-    # Empty arrays mimicking Nullpointers
-    facet_index = numpy.zeros(0, dtype=numpy.int32)
-    facet_perm = numpy.zeros(0, dtype=numpy.uint8)
+    x_dofmap, x = mesh
+
+    # Per-cell buffers holding the MPC block of each cell, written
+    # concurrently and flushed serially
+    num_cells = len(active_cells)
+    max_slaves, max_masters = scratch_sizes
+    max_block = num_dofs_per_element + max_masters
+    block_positions = numpy.zeros((num_cells, max_block),
+                                  dtype=numpy.int32)
+    block_values = numpy.zeros((num_cells, max_block*max_block),
+                               dtype=PETSc.ScalarType)
+    block_sizes = numpy.zeros(num_cells, dtype=numpy.int32)
+
+    # Loop over all cells; each iteration only writes to its own slot
+    # of the buffers, keeping the result deterministic
+    for i in numba.prange(num_cells):
+        cell_index = active_cells[i]
+        slave_cell_index = slave_cell_map[cell_index]
 
-    # NOTE: All cells are assumed to be of the same type
-    geometry = numpy.zeros((pos[1]-pos[0], gdim))
-
-    A_local = numpy.zeros((num_dofs_per_element, num_dofs_per_element),
-                          dtype=PETSc.ScalarType)
+        # Local dof position
+        local_pos = dofmap[cell_index]
+        # If all dofs of the cell are in the Dirichlet bcs, the element
+        # tensor would be zeroed in full, so skip the tabulation
+        num_bc_dofs = 0
+        if len(bc_dofs) > 0:
+            for k in range(len(local_pos)):
+                if local_pos[k] in bc_dofs:
+                    num_bc_dofs += 1
+        if num_bc_dofs == num_dofs_per_element:
+            block_sizes[i] = 0
+            continue
 
-    # Loop over all cells
-    for slave_cell_index, cell_index in enumerate(active_cells):
-        num_vertices = pos[cell_index + 1] - pos[cell_index]
+        # Thread-private scratch
+        facet_index = numpy.zeros(0, dtype=numpy.int32)
+        facet_perm = numpy.zeros(0, dtype=numpy.uint8)
+        geometry = numpy.zeros((num_vertices, gdim))
+        A_local = numpy.zeros(
+            (num_dofs_per_element, num_dofs_per_element),
+            dtype=PETSc.ScalarType)
+        master_offset = numpy.zeros(max_slaves + 1, dtype=numpy.int32)
+        is_slave = numpy.zeros(num_dofs_per_element, dtype=numpy.int8)
 
         # Compute vertices of cell from mesh data
         # FIXME: This assumes a particular geometry dof layout
-        cell = pos[cell_index]
-        c = x_dofmap[cell:cell + num_vertices]
-        for j in range(num_vertices):
-            for k in range(gdim):
-                geometry[j, k] = x[c[j], k]
+        geometry[:, :] = x[x_dofmap[cell_index], :gdim]
 
-        A_local.fill(0.0)
         # FIXME: Numba does not support edge reflections
         kernel(ffi_fb(A_local), ffi_fb(coeffs[cell_index, :]),
                ffi_fb(constants), ffi_fb(geometry),
                ffi_fb(facet_index), ffi_fb(facet_perm),
                permutation_info[cell_index])
 
-        # Local dof position
-        local_pos = dofmap[num_dofs_per_element * cell_index:
-                           num_dofs_per_element * cell_index
-                           + num_dofs_per_element]
         # Remove all contributions for dofs that are in the Dirichlet bcs
-        if len(bcs) > 0:
+        if num_bc_dofs > 0:
             for k in range(len(local_pos)):
-                is_bc_dof = in_numpy_array(bcs, local_pos[k])
-                if is_bc_dof:
+                if local_pos[k] in bc_dofs:
                     A_local[k, :] = 0
                     A_local[:, k] = 0
 
-        A_local_copy = A_local.copy()
-        # If this slave contains a slave dof, modify local contribution
-        modify_mpc_cell_local(A, slave_cell_index, A_local, A_local_copy,
-                              local_pos, mpc, num_dofs_per_element)
-        # Remove already assembled contribution to matrix
-        A_contribution = A_local - A_local_copy
-
-        # Insert local contribution
-        ierr_loc = set_values_local(A, num_dofs_per_element, ffi_fb(local_pos),
-                                    num_dofs_per_element, ffi_fb(local_pos),
-                                    ffi_fb(A_contribution), mode)
-        assert(ierr_loc == 0)
+        # If this cell contains a slave dof, compute the modification
+        block_sizes[i] = fill_mpc_block(slave_cell_index, A_local,
+                                        local_pos, mpc,
+                                        num_dofs_per_element,
+                                        block_positions[i],
+                                        block_values[i], master_offset,
+                                        is_slave)
+
+    # Serial flush of the collected blocks to PETSc
+    for i in range(num_cells):
+        block_size = block_sizes[i]
+        if block_size == 0:
+            continue
+        ierr_block = set_values_local(A, block_size,
+                                      ffi_fb(block_positions[i]),
+                                      block_size,
+                                      ffi_fb(block_positions[i]),
+                                      ffi_fb(block_values[i]), mode)
+        assert(ierr_block == 0)
 
-    sink(A_contribution, local_pos)
+    sink(block_positions, block_values)
 
 
-@numba.njit
-def assemble_exterior_facets(A, kernel, mesh, gdim, coeffs, consts, perm,
-                             dofmap, num_dofs_per_element, facet_info,
-                             mpc, bcs):
+@numba.njit(fastmath=True, boundscheck=False, error_model='numpy')
+def assemble_exterior_facets(A, kernel, mesh, gdim, num_vertices, coeffs,
+                             consts, perm, dofmap, num_dofs_per_element,
+                             facet_info, mpc, slave_cell_map, bc_dofs,
+                             scratch_sizes):
     """Assemble MPC contributions over exterior facet integrals"""
-
-    slave_cells = mpc[4]  # Note: packing order for MPC really important
+    # Specialize the compiled kernel on the element sizes, so the inner
+    # loops get compile-time trip counts and can be unrolled
+    numba.literally(num_dofs_per_element)
+    numba.literally(gdim)
+    numba.literally(num_vertices)
+    ffi_fb = ffi.from_buffer
 
     # Mesh data
-    pos, x_dofmap, x = mesh
+    x_dofmap, x = mesh
 
     # Empty arrays for facet information
     facet_index = numpy.zeros(1, dtype=numpy.int32)
     facet_perm = numpy.zeros(1, dtype=numpy.uint8)
 
     # NOTE: All cells are assumed to be of the same type
-    geometry = numpy.zeros((pos[1] - pos[0], gdim))
+    geometry = numpy.zeros((num_vertices, gdim))
 
     A_local = numpy.zeros((num_dofs_per_element, num_dofs_per_element),
                           dtype=PETSc.ScalarType)
 
+    # Scratch for the MPC block insertion, sized for the largest
+    # (cell dofs + masters) block on any slave cell
+    (block_pos, block_vals, master_offset, is_slave,
+     block_pos_ptr, block_vals_ptr) = pack_mpc_scratch(num_dofs_per_element,
+                                                       scratch_sizes)
+
+    # Loop-invariant CFFI handles for the buffers reused by every facet
+    A_local_ptr = ffi_fb(A_local)
+    geometry_ptr = ffi_fb(geometry)
+    consts_ptr = ffi_fb(consts)
+    facet_index_ptr = ffi_fb(facet_index)
+    facet_perm_ptr = ffi_fb(facet_perm)
+
     # Permutation info
     cell_perms, facet_perms = perm
 
     # Loop over all external facets that are active
     for i in range(facet_info.shape[0]):
         cell_index, local_facet = facet_info[i]
-        if not in_numpy_array(slave_cells, cell_index):
+        slave_cell_index = slave_cell_map.get(cell_index, -1)
+        if slave_cell_index == -1:
+            continue
+
+        local_pos = dofmap[cell_index]
+
+        # If all dofs of the cell are in the Dirichlet bcs, the element
+        # tensor would be zeroed in full, so skip the tabulation
+        num_bc_dofs = 0
+        if len(bc_dofs) > 0:
+            for k in range(len(local_pos)):
+                if local_pos[k] in bc_dofs:
+                    num_bc_dofs += 1
+        if num_bc_dofs == num_dofs_per_element:
             continue
-        slave_cell_index = numpy.flatnonzero(slave_cells == cell_index)[0]
 
-        cell = pos[cell_index]
         facet_index[0] = local_facet
-        num_vertices = pos[cell_index + 1] - pos[cell_index]
 
         # FIXME: This assumes a particular geometry dof layout
-        c = x_dofmap[cell:cell + num_vertices]
-        for j in range(num_vertices):
-            for k in range(gdim):
-                geometry[j, k] = x[c[j], k]
+        geometry[:, :] = x[x_dofmap[cell_index], :gdim]
 
         A_local.fill(0.0)
         facet_perm[0] = facet_perms[local_facet, cell_index]
-        kernel(ffi.from_buffer(A_local),
-               ffi.from_buffer(coeffs[cell_index, :]),
-               ffi.from_buffer(consts),
-               ffi.from_buffer(geometry),
-               ffi.from_buffer(facet_index),
-               ffi.from_buffer(facet_perm),
+        kernel(A_local_ptr,
+               ffi_fb(coeffs[cell_index, :]),
+               consts_ptr,
+               geometry_ptr,
+               facet_index_ptr,
+               facet_perm_ptr,
                cell_perms[cell_index])
 
-        local_pos = dofmap[num_dofs_per_element * cell_index:
-                           num_dofs_per_element * cell_index
-                           + num_dofs_per_element]
-
         # Remove all contributions for dofs that are in the Dirichlet bcs
-        if len(bcs) > 0:
+        if num_bc_dofs > 0:
             for k in range(len(local_pos)):
-                is_bc_dof = in_numpy_array(bcs, local_pos[k])
-                if is_bc_dof:
+                if local_pos[k] in bc_dofs:
                     A_local[k, :] = 0
                     A_local[:, k] = 0
 
-        A_local_copy = A_local.copy()
-        # If this slave contains a slave dof, modify local contribution
-        modify_mpc_cell_local(A, slave_cell_index, A_local, A_local_copy,
-                              local_pos, mpc, num_dofs_per_element)
-
-        # Remove already assembled contribution to matrix
-        A_contribution = A_local - A_local_copy
-
-        # Insert local contribution
-        ierr_loc = set_values_local(A,
-                                    num_dofs_per_element, ffi.from_buffer(
-                                        local_pos),
-                                    num_dofs_per_element, ffi.from_buffer(
-                                        local_pos),
-                                    ffi.from_buffer(A_contribution), mode)
-        assert(ierr_loc == 0)
-
-    sink(A_contribution, local_pos)
-
-
-@numba.njit
-def modify_mpc_cell_local(A, slave_cell_index, A_local, A_local_copy,
-                          local_pos, mpc, num_dofs_per_element):
+        # If this cell contains a slave dof, compute the modification
+        block_size = fill_mpc_block(slave_cell_index, A_local,
+                                    local_pos, mpc, num_dofs_per_element,
+                                    block_pos, block_vals, master_offset,
+                                    is_slave)
+        # Insert the correction of the already assembled contribution
+        # and all contributions that moved to masters in one call
+        ierr_block = set_values_local(A, block_size, block_pos_ptr,
+                                      block_size, block_pos_ptr,
+                                      block_vals_ptr, mode)
+        assert(ierr_block == 0)
+
+    sink(block_pos, block_vals)
+
+
+# NOTE: Takes a jitclass instance, which numba cannot cache on disk
+@numba.njit(fastmath=True, boundscheck=False, error_model='numpy')
+def fill_mpc_block(slave_cell_index, A_local, local_pos, mpc,
+                   num_dofs_per_element, block_pos, block_vals,
+                   master_offset, is_slave):
     """
-    Modifies A_local as it contains slave degrees of freedom.
-    Adds contributions to corresponding master degrees of freedom in A.
+    Accumulates the contributions of the element tensor A_local moved
+    to master degrees of freedom in one dense block, indexed by the
+    cell dofs followed by all masters of the cell slaves. The (cell
+    dof, cell dof) part of the block holds the correction to the
+    already assembled contribution, so the whole modification is
+    inserted with a single MatSetValuesLocal call. A_local is not
+    modified. Returns the block size.
     """
-    ffi_fb = ffi.from_buffer
-
-    # Unpack MPC data
-    (slaves, masters_local, coefficients, offsets, slave_cells,
-     cell_to_slave, cell_to_slave_offsets) = mpc
-
-    # Rows taken over by master
-    A_row = numpy.zeros((num_dofs_per_element, 1), dtype=PETSc.ScalarType)
-    # Columns taken over by master
-    A_col = numpy.zeros((1, num_dofs_per_element), dtype=PETSc.ScalarType)
-    # Extra insertions at master diagonal
-    A_master = numpy.zeros((1, 1), dtype=PETSc.ScalarType)
-    # Cross-master coefficients, m0, m1 for same constraint
-    A_c0 = numpy.zeros((1, 1), dtype=PETSc.ScalarType)
-    A_c1 = numpy.zeros((1, 1), dtype=PETSc.ScalarType)
-    # Cross-master coefficients, m0, m1, master to multiple slave
-    A_m0m1 = numpy.zeros((1, 1), dtype=PETSc.ScalarType)
-    A_m1m0 = numpy.zeros((1, 1), dtype=PETSc.ScalarType)
-    # Index arrays used in set_values and set_values_local
-    m0_index = numpy.zeros(1, dtype=numpy.int32)
-    m1_index = numpy.zeros(1, dtype=numpy.int32)
+    numba.literally(num_dofs_per_element)
+    # Local aliases for the MPC fields used in the loops
+    masters_local = mpc.masters_local
+    coefficients = mpc.coefficients
+    offsets = mpc.offsets
+    cell_to_slave = mpc.cell_to_slave
+    cell_to_slave_offsets = mpc.cell_to_slave_offsets
+    cell_slave_local = mpc.cell_slave_local
 
     cell_slaves = cell_to_slave[cell_to_slave_offsets[slave_cell_index]:
                                 cell_to_slave_offsets[slave_cell_index+1]]
-
-    for i, slave_index in enumerate(cell_slaves):
-        cell_masters = masters_local[offsets[slave_index]:
-                                     offsets[slave_index+1]]
+    num_slaves = len(cell_slaves)
+
+    # Local position of each cell slave within the cell dofs,
+    # precomputed in assemble_matrix
+    slave_local = cell_slave_local[
+        cell_to_slave_offsets[slave_cell_index]:
+        cell_to_slave_offsets[slave_cell_index+1]]
+
+    # Mark the slave positions, so that the accumulation loops can skip
+    # them in a single pass instead of zeroing entries afterwards
+    is_slave[:] = 0
+    for j in range(num_slaves):
+        is_slave[slave_local[j]] = 1
+
+    # Position of the first master of the i-th cell slave in the block
+    master_offset[0] = num_dofs_per_element
+    for i in range(num_slaves):
+        master_offset[i+1] = (master_offset[i]
+                              + offsets[cell_slaves[i]+1]
+                              - offsets[cell_slaves[i]])
+
+    # Block indices: the cell dofs followed by all masters on the cell
+    block_size = master_offset[num_slaves]
+    block_pos[:num_dofs_per_element] = local_pos
+    for i in range(num_slaves):
+        block_pos[master_offset[i]:master_offset[i+1]] = \
+            masters_local[offsets[cell_slaves[i]]:offsets[cell_slaves[i]+1]]
+    A_block = block_vals[:block_size*block_size].reshape(
+        block_size, block_size)
+    A_block[:, :] = 0.0
+
+    for i in range(num_slaves):
+        slave_index = cell_slaves[i]
         cell_coeffs = coefficients[offsets[slave_index]:
                                    offsets[slave_index+1]]
-        # # Variable for local position of slave dof
-        local_idx = numpy.flatnonzero(
-            slaves[slave_index] == local_pos)[0]
+        # Variable for local position of slave dof
+        local_idx = slave_local[i]
         # Loop through each master dof to take individual contributions
-        for master, coeff in zip(cell_masters, cell_coeffs):
-            # Reset local contribution matrices
-            A_row.fill(0.0)
-            A_col.fill(0.0)
-            # Move local contributions with correct coefficients
-            A_row[:, 0] = coeff*A_local_copy[:, local_idx]
-            A_col[0, :] = coeff*A_local_copy[local_idx, :]
-            A_master[0, 0] = coeff*A_row[local_idx, 0]
-
-            # Remove row contribution going to central addition
-            A_col[0, local_idx] = 0
-            A_row[local_idx, 0] = 0
-
-            # Remove local contributions moved to master
-            A_local[:, local_idx] = 0
-            A_local[local_idx, :] = 0
+        for i_master, coeff in enumerate(cell_coeffs):
+            mi = master_offset[i] + i_master
+            # Move slave row and column to the master with the correct
+            # coefficient, skipping entries at slave dofs (which move
+            # to the master diagonal or to the masters of the other
+            # cell slaves)
+            for k in range(num_dofs_per_element):
+                if is_slave[k] == 0:
+                    A_block[k, mi] += coeff*A_local[k, local_idx]
+                    A_block[mi, k] += coeff*A_local[local_idx, k]
+            # Add slave contributions to A_(master, master)
+            A_block[mi, mi] += coeff*coeff*A_local[local_idx, local_idx]
 
             # If one of the other local indices are a slave,
             # move them to the corresponding master dof
             # and multiply by the corresponding coefficient
-            for j, other_slave in enumerate(cell_slaves):
-                # Find local index of the other slave
-                o_local_idx = numpy.flatnonzero(
-                    slaves[other_slave] == local_pos)[0]
-                # Zero out for other slave
-                A_row[o_local_idx, 0] = 0
-                A_col[0, o_local_idx] = 0
-
-                # Masters for other cell
-                other_cell_masters = masters_local[offsets[other_slave]:
-                                                   offsets[other_slave+1]]
+            for j in range(i+1, num_slaves):
+                other_slave = cell_slaves[j]
+                o_local_idx = slave_local[j]
                 other_coeffs = coefficients[offsets[other_slave]:
                                             offsets[other_slave+1]]
-                # Add cross terms for masters
-                for (other_master, other_coeff) in zip(other_cell_masters,
-                                                       other_coeffs):
-                    A_m0m1.fill(0)
-                    A_m1m0.fill(0)
-                    A_m0m1[0, 0] = coeff*other_coeff*A_local_copy[local_idx,
-                                                                  o_local_idx]
-                    A_m1m0[0, 0] = coeff*other_coeff*A_local_copy[o_local_idx,
-                                                                  local_idx]
-                    m0_index[0] = master
-                    m1_index[0] = other_master
-                    # Insert only once per slave pair on each cell
-                    if j > i:
-                        ierr_m0m1 = set_values_local(A, 1, ffi_fb(m0_index),
-                                                     1, ffi_fb(m1_index),
-                                                     ffi_fb(A_m0m1), mode)
-                        assert(ierr_m0m1 == 0)
-                        ierr_m1m0 = set_values_local(A, 1, ffi_fb(m1_index),
-                                                     1, ffi_fb(m0_index),
-                                                     ffi_fb(A_m1m0), mode)
-                        assert(ierr_m1m0 == 0)
-
-            # Add slave column to master column
-            mpc_pos = local_pos.copy()
-            mpc_pos[local_idx] = master
-            m0_index[0] = master
-
-            ierr_row = set_values_local(A, num_dofs_per_element,
-                                        ffi_fb(mpc_pos),
-                                        1, ffi_fb(m0_index),
-                                        ffi_fb(A_row), mode)
-            assert(ierr_row == 0)
-
-            # Add slave row to master row
-            ierr_col = set_values_local(A,
-                                        1, ffi_fb(m0_index),
-                                        num_dofs_per_element,
-                                        ffi_fb(mpc_pos),
-                                        ffi_fb(A_col), mode)
-            assert(ierr_col == 0)
-            # Add slave contributions to A_(master, master)
-            ierr_m0m0 = set_values_local(A,
-                                         1, ffi_fb(m0_index),
-                                         1, ffi_fb(m0_index),
-                                         ffi_fb(A_master), mode)
-
-            assert(ierr_m0m0 == 0)
+                # Add cross terms for masters of different slaves
+                for j_master, other_coeff in enumerate(other_coeffs):
+                    mj = master_offset[j] + j_master
+                    A_block[mi, mj] += coeff*other_coeff * \
+                        A_local[local_idx, o_local_idx]
+                    A_block[mj, mi] += coeff*other_coeff * \
+                        A_local[o_local_idx, local_idx]
 
         # Add contributions for different masters on the same cell
-        for i_0, (m0, c0) in enumerate(zip(cell_masters, cell_coeffs)):
-            for i_1 in range(i_0+1, len(cell_masters)):
-                A_c0.fill(0.0)
+        for i_0 in range(len(cell_coeffs)):
+            c0 = cell_coeffs[i_0]
+            for i_1 in range(i_0+1, len(cell_coeffs)):
                 c1 = cell_coeffs[i_1]
-                A_c0[0, 0] += c0*c1 * \
-                    A_local_copy[local_idx, local_idx]
-                m0_index[0] = m0
-                m1_index[0] = cell_masters[i_1]
-                ierr_c0 = set_values_local(A,
-                                           1, ffi_fb(m0_index),
-                                           1, ffi_fb(m1_index),
-                                           ffi_fb(A_c0), mode)
-                assert(ierr_c0 == 0)
-                A_c1.fill(0.0)
-                A_c1[0, 0] += c0*c1 * \
-                    A_local_copy[local_idx, local_idx]
-                ierr_c1 = set_values_local(A,
-                                           1, ffi_fb(m1_index),
-                                           1, ffi_fb(m0_index),
-                                           ffi_fb(A_c1), mode)
-                assert(ierr_c1 == 0)
-
-    sink(A_m0m1, A_m1m0, m1_index, A_row, A_col, m0_index, mpc_pos,
-         A_master, A_c0, A_c1)
-
-    return A_local
+                m0 = master_offset[i] + i_0
+                m1 = master_offset[i] + i_1
+                # The (m0, m1) and (m1, m0) contributions are
+                # identical, so compute the product once
+                cross_term = c0*c1*A_local[local_idx, local_idx]
+                A_block[m0, m1] += cross_term
+                A_block[m1, m0] += cross_term
+
+    # Correction to the already assembled contribution: subtract the
+    # slave rows and columns, which have been moved to the masters.
+    # The column pass skips slave rows, which the row pass already
+    # subtracted
+    for j in range(num_slaves):
+        local_idx = slave_local[j]
+        for k in range(num_dofs_per_element):
+            A_block[local_idx, k] -= A_local[local_idx, k]
+            if is_slave[k] == 0:
+                A_block[k, local_idx] -= A_local[k, local_idx]
+
+    return block_size
@@ -3,25 +3,84 @@
 # This file is part of DOLFINX_MPC
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
+import ctypes
+
 import numba
 import numpy
 
 import dolfinx
 import dolfinx.common
 import dolfinx.log
+import dolfinx_mpc.cpp
 
-from .assemble_matrix import in_numpy_array, pack_facet_info
+from .assemble_matrix import compute_cell_slave_local, pack_facet_info
 from .numba_setup import PETSc, ffi
 
 Timer = dolfinx.common.Timer
 
+# Signature of the UFC tabulate_tensor kernels, as a ctypes prototype:
+# (element tensor, coefficients, constants, coordinates, local entity
+# index, entity permutation, cell permutation)
+_tabulate_tensor_prototype = ctypes.CFUNCTYPE(
+    None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+    ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32)
+
+
+def _as_ctypes_kernel(tabulate_tensor):
+    """
+    Wrap a CFFI tabulate_tensor function pointer in the ctypes
+    prototype, so the numba kernels call it directly with raw data
+    pointers instead of wrapping every argument with ffi.from_buffer
+    per call
+    """
+    return _tabulate_tensor_prototype(
+        int(ffi.cast("uintptr_t", tabulate_tensor)))
+
+
+# Compiled forms and ctypes-wrapped tabulation kernels, keyed by the
+# form signature (and integral for the kernels). Assembling the same
+# form repeatedly, e.g. in a time-stepping loop, then skips the
+# ffcx_jit lookup and kernel wrapping
+_ufc_form_cache = {}
+_tabulate_kernel_cache = {}
+
 
 def assemble_vector(form, constraint,
-                    bcs=[numpy.array([]), numpy.array([])]):
+                    bcs=[numpy.array([]), numpy.array([])],
+                    backend=None):
+    """
+    Assemble a linear form into a vector with the multi point
+    constraint applied.
+    The backend keyword selects the MPC assembler: "cpp" for the
+    compiled extension, "numba" for the JIT kernels, or None (default)
+    to use the compiled assembler when the extension provides it.
+    """
     dolfinx.log.log(dolfinx.log.LogLevel.INFO, "Assemble MPC vector")
     timer_vector = Timer("~MPC: Assemble vector")
     bc_dofs, bc_values = bcs
     V = form.arguments()[0].ufl_function_space()
+
+    index_map = constraint.index_map()
+    vector = dolfinx.cpp.la.create_vector(index_map)
+    cpp_form = dolfinx.Form(form)._cpp_object
+
+    # Assemble with the compiled C++ assembler or the numba kernels
+    cpp_assembler = getattr(dolfinx_mpc.cpp.mpc, "assemble_vector", None)
+    if backend is None:
+        backend = "cpp" if cpp_assembler is not None else "numba"
+    if backend not in ("cpp", "numba"):
+        raise RuntimeError(
+            "Unknown MPC assembly backend {0:s}".format(backend))
+    if backend == "cpp":
+        if cpp_assembler is None:
+            raise RuntimeError(
+                "Compiled MPC vector assembler not available")
+        with vector.localForm() as b_local:
+            cpp_assembler(numpy.asarray(b_local), cpp_form,
+                          constraint._cpp_object)
+        timer_vector.stop()
+        return vector
+
     # Unpack mesh and dofmap data
     pos = V.mesh.geometry.dofmap.offsets
     x_dofs = V.mesh.geometry.dofmap.array
@@ -39,133 +98,217 @@ def assemble_vector(form, constraint,
     masters_local = masters.array
     offsets = masters.offsets
 
+    num_dofs_per_element = (V.dofmap.dof_layout.num_dofs *
+                            V.dofmap.dof_layout.block_size())
+
+    # Local position of each cell slave within the cell dofs, aligned
+    # with cell_to_slave, so the kernels look the position up instead
+    # of scanning the cell dofs for every slave and master
+    cell_slave_local = compute_cell_slave_local(
+        slave_cells, dofs.reshape(-1, num_dofs_per_element), slaves_local,
+        cell_to_slave, c_to_s_off)
+
     mpc_data = (slaves_local, masters_local, coefficients, offsets,
-                slave_cells, cell_to_slave, c_to_s_off)
+                slave_cells, cell_to_slave, c_to_s_off, cell_slave_local)
+
     # Get index map and ghost info
-    index_map = constraint.index_map()
-    vector = dolfinx.cpp.la.create_vector(index_map)
-    ufc_form = dolfinx.jit.ffcx_jit(form)
+    form_signature = form.signature()
+    ufc_form = _ufc_form_cache.get(form_signature)
+    if ufc_form is None:
+        ufc_form = dolfinx.jit.ffcx_jit(form)
+        _ufc_form_cache[form_signature] = ufc_form
 
     # Pack constants and coefficients
-    cpp_form = dolfinx.Form(form)._cpp_object
     form_coeffs = dolfinx.cpp.fem.pack_coefficients(cpp_form)
     form_consts = dolfinx.cpp.fem.pack_constants(cpp_form)
 
     formintegral = cpp_form.integrals
     gdim = V.mesh.geometry.dim
     tdim = V.mesh.topology.dim
-    num_dofs_per_element = (V.dofmap.dof_layout.num_dofs *
-                            V.dofmap.dof_layout.block_size())
 
-    # Assemble vector with all entries
-    dolfinx.cpp.fem.assemble_vector(vector.array_w, cpp_form)
-    # Assemble over cells
-    subdomain_ids = formintegral.integral_ids(
-        dolfinx.fem.IntegralType.cell)
-    num_cell_integrals = len(subdomain_ids)
-    if num_cell_integrals > 0:
-        V.mesh.topology.create_entity_permutations()
-        permutation_info = V.mesh.topology.get_cell_permutation_info()
-
-    for i in range(num_cell_integrals):
-        subdomain_id = subdomain_ids[i]
-        with Timer("*MPC: Assemble vector (cell kernel)"):
-            cell_kernel = ufc_form.create_cell_integral(
-                subdomain_id).tabulate_tensor
-        active_cells = numpy.array(formintegral.integral_domains(
-            dolfinx.fem.IntegralType.cell, i), dtype=numpy.int64)
-        slave_cell_indices = numpy.flatnonzero(
-            numpy.isin(active_cells, slave_cells))
-        with Timer("*MPC: Assemble vector (cell numba)"):
-            with vector.localForm() as b:
-                assemble_cells(numpy.asarray(b), cell_kernel,
-                               active_cells[slave_cell_indices],
-                               (pos, x_dofs, x), gdim,
+    # Pack the cell geometry once with a vectorized gather; the
+    # kernels then read a contiguous (num_vertices, gdim) view per
+    # cell instead of gathering the coordinates indirectly per cell
+    # FIXME: This assumes a particular geometry dof layout
+    num_vertices_per_cell = pos[1] - pos[0]
+    packed_geometry = x[x_dofs.reshape(-1, num_vertices_per_cell), :gdim]
+
+    # Dense map from cell index to index in slave_cells (-1 for cells
+    # without slaves), so the kernels identify slave cells with a
+    # single load instead of scanning slave_cells per cell
+    num_cells = len(dofs) // num_dofs_per_element
+    cell_to_slave_cell = numpy.full(num_cells, -1, dtype=numpy.int32)
+    cell_to_slave_cell[slave_cells] = numpy.arange(len(slave_cells),
+                                                   dtype=numpy.int32)
+
+    # Largest number of master contributions of any slave cell, used
+    # to size the per-cell update buffers of the kernels
+    if len(slave_cells) > 0:
+        masters_per_cell = numpy.add.reduceat(
+            numpy.diff(offsets)[cell_to_slave], c_to_s_off[:-1])
+        max_updates_per_cell = int(numpy.max(masters_per_cell))
+    else:
+        max_updates_per_cell = 0
+
+    # The kernels below assemble the unconstrained contributions and
+    # the MPC modifications in a single pass over the cells, so every
+    # element vector is tabulated exactly once and b is written once.
+    # Only cell and exterior facet integrals are supported
+    assert(len(formintegral.integral_ids(
+        dolfinx.fem.IntegralType.interior_facet)) == 0)
+    # Acquire the local form once for all integrals, so the PETSc
+    # local form and the numpy wrapper are not re-created per integral
+    with vector.localForm() as b_local:
+        b = numpy.asarray(b_local)
+        # Assemble over cells
+        subdomain_ids = formintegral.integral_ids(
+            dolfinx.fem.IntegralType.cell)
+        num_cell_integrals = len(subdomain_ids)
+        if num_cell_integrals > 0:
+            V.mesh.topology.create_entity_permutations()
+            permutation_info = \
+                V.mesh.topology.get_cell_permutation_info()
+
+        for i in range(num_cell_integrals):
+            subdomain_id = subdomain_ids[i]
+            with Timer("*MPC: Assemble vector (cell kernel)"):
+                kernel_key = (form_signature, "cell", subdomain_id)
+                cell_kernel = _tabulate_kernel_cache.get(kernel_key)
+                if cell_kernel is None:
+                    cell_kernel = _as_ctypes_kernel(
+                        ufc_form.create_cell_integral(
+                            subdomain_id).tabulate_tensor)
+                    _tabulate_kernel_cache[kernel_key] = cell_kernel
+            active_cells = numpy.array(formintegral.integral_domains(
+                dolfinx.fem.IntegralType.cell, i), dtype=numpy.int64)
+            with Timer("*MPC: Assemble vector (cell numba)"):
+                assemble_cells(b, cell_kernel,
+                               active_cells,
+                               packed_geometry,
                                form_coeffs, form_consts,
                                permutation_info,
                                dofs, num_dofs_per_element, mpc_data,
+                               cell_to_slave_cell, max_updates_per_cell,
                                (bc_dofs, bc_values))
 
-    # Assemble exterior facet integrals
-    subdomain_ids = formintegral.integral_ids(
-        dolfinx.fem.IntegralType.exterior_facet)
-    num_exterior_integrals = len(subdomain_ids)
-    if num_exterior_integrals > 0:
-        V.mesh.topology.create_entities(tdim - 1)
-        V.mesh.topology.create_connectivity(tdim - 1, tdim)
-        permutation_info = V.mesh.topology.get_cell_permutation_info()
-        facet_permutation_info = V.mesh.topology.get_facet_permutations()
-    for i in range(num_exterior_integrals):
-        facet_info = pack_facet_info(V.mesh, formintegral, i)
-        subdomain_id = subdomain_ids[i]
-        facet_kernel = ufc_form.create_exterior_facet_integral(
-            subdomain_id).tabulate_tensor
-        with Timer("*MPC: Assemble vector (facet numba)"):
-            with vector.localForm() as b:
-                assemble_exterior_facets(numpy.asarray(b), facet_kernel,
+        # Assemble exterior facet integrals
+        subdomain_ids = formintegral.integral_ids(
+            dolfinx.fem.IntegralType.exterior_facet)
+        num_exterior_integrals = len(subdomain_ids)
+        if num_exterior_integrals > 0:
+            V.mesh.topology.create_entities(tdim - 1)
+            V.mesh.topology.create_connectivity(tdim - 1, tdim)
+            permutation_info = \
+                V.mesh.topology.get_cell_permutation_info()
+            facet_permutation_info = \
+                V.mesh.topology.get_facet_permutations()
+        for i in range(num_exterior_integrals):
+            facet_info = pack_facet_info(V.mesh, formintegral, i)
+            # Gather the geometry and coefficients of the facet cells
+            # once, aligned with facet_info, as done for the cell
+            # integrals
+            facet_geometry = packed_geometry[facet_info[:, 0]]
+            facet_coeffs = form_coeffs[facet_info[:, 0]]
+            subdomain_id = subdomain_ids[i]
+            kernel_key = (form_signature, "exterior_facet",
+                          subdomain_id)
+            facet_kernel = _tabulate_kernel_cache.get(kernel_key)
+            if facet_kernel is None:
+                facet_kernel = _as_ctypes_kernel(
+                    ufc_form.create_exterior_facet_integral(
+                        subdomain_id).tabulate_tensor)
+                _tabulate_kernel_cache[kernel_key] = facet_kernel
+            with Timer("*MPC: Assemble vector (facet numba)"):
+                assemble_exterior_facets(b, facet_kernel,
                                          facet_info,
-                                         (pos, x_dofs, x),
-                                         gdim, form_coeffs, form_consts,
+                                         facet_geometry,
+                                         facet_coeffs, form_consts,
                                          (permutation_info,
-                                             facet_permutation_info), dofs,
+                                             facet_permutation_info),
+                                         dofs,
                                          num_dofs_per_element,
-                                         mpc_data, (bc_dofs, bc_values))
+                                         mpc_data, cell_to_slave_cell,
+                                         max_updates_per_cell,
+                                         (bc_dofs, bc_values))
     timer_vector.stop()
     return vector
 
 
-@numba.njit
-def assemble_cells(b, kernel, active_cells, mesh, gdim,
+# NOTE: The assemblers take the tabulation kernel as a ctypes function
+# pointer, whose address is process-specific, so they cannot be cached
+# on disk or compiled ahead of time with an explicit signature
+@numba.njit(parallel=True, fastmath=True, boundscheck=False,
+            error_model='numpy')
+def assemble_cells(b, kernel, active_cells, geometry,
                    coeffs, constants,
                    permutation_info, dofmap, num_dofs_per_element,
-                   mpc, bcs):
-    """Assemble additional MPC contributions for cell integrals"""
-    ffi_fb = ffi.from_buffer
+                   mpc, cell_to_slave_cell, max_updates_per_cell, bcs):
+    """
+    Assemble the cell integral contributions, with the MPC
+    modification applied to the element vectors of slave cells before
+    insertion. The element vectors are computed in a parallel loop
+    into per-cell buffers, which are reduced into b in a second,
+    serial pass, keeping the result deterministic and free of data
+    races.
+    """
     (bcs, values) = bcs
 
-    # Empty arrays mimicking Nullpointers
-    facet_index = numpy.zeros(0, dtype=numpy.int32)
-    facet_perm = numpy.zeros(0, dtype=numpy.uint8)
-
-    # Unpack mesh data
-    pos, x_dofmap, x = mesh
-
-    geometry = numpy.zeros((pos[1]-pos[0], gdim))
-    b_local = numpy.zeros(num_dofs_per_element, dtype=PETSc.ScalarType)
-
-    for slave_cell_index, cell_index in enumerate(active_cells):
-        num_vertices = pos[cell_index + 1] - pos[cell_index]
-        # FIXME: This assumes a particular geometry dof layout
-        cell = pos[cell_index]
-        c = x_dofmap[cell:cell + num_vertices]
-        for j in range(num_vertices):
-            for k in range(gdim):
-                geometry[j, k] = x[c[j], k]
-        b_local.fill(0.0)
-
-        kernel(ffi_fb(b_local), ffi_fb(coeffs[cell_index, :]),
-               ffi_fb(constants), ffi_fb(geometry), ffi_fb(facet_index),
-               ffi_fb(facet_perm),
+    # Per-cell element vectors and master update buffers, written
+    # concurrently and reduced serially
+    num_cells = len(active_cells)
+    b_locals = numpy.zeros((num_cells, num_dofs_per_element),
+                           dtype=PETSc.ScalarType)
+    update_pos = numpy.zeros((num_cells, max_updates_per_cell),
+                             dtype=numpy.int32)
+    update_val = numpy.zeros((num_cells, max_updates_per_cell),
+                             dtype=PETSc.ScalarType)
+    update_count = numpy.zeros(num_cells, dtype=numpy.int32)
+
+    for i in numba.prange(num_cells):
+        cell_index = active_cells[i]
+
+        # Thread-private scratch
+        facet_index = numpy.zeros(0, dtype=numpy.int32)
+        facet_perm = numpy.zeros(0, dtype=numpy.uint8)
+        b_local = b_locals[i]
+
+        kernel(b_local.ctypes.data,
+               coeffs[cell_index, :].ctypes.data,
+               constants.ctypes.data,
+               geometry[cell_index].ctypes.data,
+               facet_index.ctypes.data, facet_perm.ctypes.data,
                permutation_info[cell_index])
 
-        b_local_copy = b_local.copy()
-        modify_mpc_contributions_local(b, cell_index, slave_cell_index,
-                                       b_local, b_local_copy, mpc, dofmap,
-                                       num_dofs_per_element)
-
+        # Move the slave entries of the element vector to the masters
+        slave_cell_index = cell_to_slave_cell[cell_index]
+        if slave_cell_index != -1:
+            update_count[i] = modify_mpc_contributions_local(
+                slave_cell_index, b_local, mpc,
+                update_pos[i], update_val[i])
+
+    # Serial reduction of the element vectors and master updates
+    for i in range(num_cells):
+        cell_index = active_cells[i]
+        cell_dofs = dofmap[cell_index * num_dofs_per_element:
+                           (cell_index + 1) * num_dofs_per_element]
         for j in range(num_dofs_per_element):
-            position = dofmap[cell_index * num_dofs_per_element + j]
-            b[position] += (b_local[j] - b_local_copy[j])
+            b[cell_dofs[j]] += b_locals[i, j]
+        for j in range(update_count[i]):
+            b[update_pos[i, j]] += update_val[i, j]
 
 
-@numba.njit
-def assemble_exterior_facets(b, kernel, facet_info, mesh, gdim,
+@numba.njit(fastmath=True, boundscheck=False, error_model='numpy')
+def assemble_exterior_facets(b, kernel, facet_info, geometry,
                              coeffs, constants,
                              permutation_info, dofmap,
                              num_dofs_per_element,
-                             mpc, bcs):
-    """Assemble additional MPC contributions for facets"""
-    ffi_fb = ffi.from_buffer
+                             mpc, cell_to_slave_cell,
+                             max_updates_per_cell, bcs):
+    """
+    Assemble the exterior facet integral contributions, with the MPC
+    modification applied to the element vectors of slave cells before
+    insertion
+    """
     (bcs, values) = bcs
 
     cell_perms, facet_perms = permutation_info
@@ -173,74 +316,88 @@ def assemble_exterior_facets(b, kernel, facet_info, mesh, gdim,
     facet_index = numpy.zeros(1, dtype=numpy.int32)
     facet_perm = numpy.zeros(1, dtype=numpy.uint8)
 
-    # Unpack mesh data
-    pos, x_dofmap, x = mesh
-
-    geometry = numpy.zeros((pos[1]-pos[0], gdim))
     b_local = numpy.zeros(num_dofs_per_element, dtype=PETSc.ScalarType)
-    slave_cells = mpc[4]
+    update_pos = numpy.zeros(max_updates_per_cell, dtype=numpy.int32)
+    update_val = numpy.zeros(max_updates_per_cell,
+                             dtype=PETSc.ScalarType)
+
+    # Loop-invariant data pointers of the buffers reused by every facet
+    b_local_ptr = b_local.ctypes.data
+    constants_ptr = constants.ctypes.data
+    facet_index_ptr = facet_index.ctypes.data
+    facet_perm_ptr = facet_perm.ctypes.data
+
     for i in range(facet_info.shape[0]):
         cell_index, local_facet = facet_info[i]
-        cell = pos[cell_index]
         facet_index[0] = local_facet
-        if not in_numpy_array(slave_cells, cell_index):
-            continue
-        slave_cell_index = numpy.flatnonzero(slave_cells == cell_index)[0]
-        num_vertices = pos[cell_index + 1] - pos[cell_index]
-        # FIXME: This assumes a particular geometry dof layout
-        c = x_dofmap[cell:cell + num_vertices]
-        for j in range(num_vertices):
-            for k in range(gdim):
-                geometry[j, k] = x[c[j], k]
         b_local.fill(0.0)
         facet_perm[0] = facet_perms[local_facet, cell_index]
-        kernel(ffi_fb(b_local), ffi_fb(coeffs[cell_index, :]),
-               ffi_fb(constants), ffi_fb(geometry), ffi_fb(facet_index),
-               ffi_fb(facet_perm),
+        kernel(b_local_ptr, coeffs[i, :].ctypes.data,
+               constants_ptr, geometry[i].ctypes.data,
+               facet_index_ptr, facet_perm_ptr,
                cell_perms[cell_index])
 
-        b_local_copy = b_local.copy()
+        # Move the slave entries of the element vector to the masters
+        slave_cell_index = cell_to_slave_cell[cell_index]
+        num_updates = 0
+        if slave_cell_index != -1:
+            num_updates = modify_mpc_contributions_local(
+                slave_cell_index, b_local, mpc,
+                update_pos, update_val)
 
-        modify_mpc_contributions_local(b, cell_index, slave_cell_index,
-                                       b_local, b_local_copy, mpc, dofmap,
-                                       num_dofs_per_element)
+        cell_dofs = dofmap[cell_index * num_dofs_per_element:
+                           (cell_index + 1) * num_dofs_per_element]
         for j in range(num_dofs_per_element):
-            position = dofmap[cell_index * num_dofs_per_element + j]
-            b[position] += (b_local[j] - b_local_copy[j])
+            b[cell_dofs[j]] += b_local[j]
+        for j in range(num_updates):
+            b[update_pos[j]] += update_val[j]
 
 
-@numba.njit(cache=True)
-def modify_mpc_contributions_local(b, cell_index, slave_cell_index,
-                                   b_local, b_copy,  mpc, dofmap,
-                                   num_dofs_per_element):
+@numba.njit(cache=True, fastmath=True, boundscheck=False,
+            error_model='numpy')
+def modify_mpc_contributions_local(slave_cell_index, b_local, mpc,
+                                   update_pos, update_val):
     """
-    Modify local entries of b_local with MPC info and add modified
-    entries to global vector b.
+    Apply the multi-point constraint to the element vector of a slave
+    cell: the slave entries of b_local are zeroed in place and their
+    values, weighted by the constraint coefficients, are recorded at
+    the master dofs in (update_pos, update_val) so the caller can
+    apply them race-free; returns their number
     """
 
     # Unwrap MPC data
     (slaves, masters_local, coefficients, offsets, slave_cells,
-     cell_to_slave, cell_to_slave_offset) = mpc
+     cell_to_slave, cell_to_slave_offset, cell_slave_local) = mpc
 
     # Determine which slaves are in this cell,
     # and which global index they have in 1D arrays
     cell_slaves = cell_to_slave[cell_to_slave_offset[slave_cell_index]:
                                 cell_to_slave_offset[slave_cell_index+1]]
 
-    glob = dofmap[num_dofs_per_element * cell_index:
-                  num_dofs_per_element * cell_index + num_dofs_per_element]
+    # Local position of each cell slave within the cell dofs,
+    # precomputed in assemble_vector
+    slave_local = cell_slave_local[
+        cell_to_slave_offset[slave_cell_index]:
+        cell_to_slave_offset[slave_cell_index+1]]
 
     # Loop over the slaves
-    for slave_index in cell_slaves:
+    num_updates = 0
+    for i in range(len(cell_slaves)):
+        slave_index = cell_slaves[i]
         cell_masters = masters_local[offsets[slave_index]:
                                      offsets[slave_index+1]]
         cell_coeffs = coefficients[offsets[slave_index]:
                                    offsets[slave_index+1]]
+        # Local position and value of the slave dof
+        k = slave_local[i]
+        slave_value = b_local[k]
 
         # Loop through each master dof to take individual contributions
         for m0, c0 in zip(cell_masters, cell_coeffs):
-            # Find local dof and add contribution to another place
-            for k, dof in enumerate(glob):
-                if dof == slaves[slave_index]:
-                    b[m0] += c0*b_copy[k]
-                    b_local[k] = 0
+            update_pos[num_updates] = m0
+            update_val[num_updates] = c0*slave_value
+            num_updates += 1
+        # The slave entry must not be inserted
+        b_local[k] = 0.0
+
+    return num_updates
@@ -0,0 +1,49 @@
+// Copyright (C) 2020 Jørgen S. Dokken
+//
+// This file is part of DOLFINX_MPC
+//
+// SPDX-License-Identifier:    LGPL-3.0-or-later
+
+#pragma once
+
+#include <petsc4py/petsc4py.h>
+#include <petscmat.h>
+#include <pybind11/pybind11.h>
+
+// pybind11 casters for PETSc/petsc4py objects, following the pattern
+// used in the DOLFINX Python wrappers
+
+namespace pybind11
+{
+namespace detail
+{
+template <>
+class type_caster<_p_Mat>
+{
+public:
+  PYBIND11_TYPE_CASTER(Mat, _("mat"));
+  bool load(handle src, bool)
+  {
+    if (src.is_none())
+    {
+      value = nullptr;
+      return true;
+    }
+    if (PyObject_TypeCheck(src.ptr(), &PyPetscMat_Type) == 0)
+      return false;
+    value = PyPetscMat_Get(src.ptr());
+    return true;
+  }
+
+  static handle cast(Mat src, pybind11::return_value_policy policy,
+                     handle parent)
+  {
+    (void)policy;
+    (void)parent;
+    return pybind11::handle(PyPetscMat_New(src));
+  }
+
+  operator Mat() { return value; }
+};
+} // namespace detail
+} // namespace pybind11
@@ -24,11 +24,16 @@ def create_contact_condition(V, meshtag, slave_marker, master_marker):
     # Locate facets with slaves (both owned and ghosted slaves)
     slave_facets = meshtag.indices[meshtag.values == slave_marker]
 
+    # Cache sub-spaces and their collapsed counterparts, as each
+    # collapse() rebuilds a dofmap and index map at the C++ level
+    subs = [V.sub(i) for i in range(tdim)]
+    collapsed_subs = [sub.collapse() for sub in subs]
+
     # Find masters from the same block as the local slave (no ghosts)
     masters_in_slave_block = []
     for i in range(tdim-1):
         loc_master_i_dofs = fem.locate_dofs_topological(
-            (V.sub(i), V.sub(i).collapse()), fdim, slave_facets)[:, 0]
+            (subs[i], collapsed_subs[i]), fdim, slave_facets)[:, 0]
         # Remove ghosts
         loc_master = loc_master_i_dofs[loc_master_i_dofs < local_size]
         masters_in_slave_block.append(loc_master)
@@ -36,7 +41,7 @@ def create_contact_condition(V, meshtag, slave_marker, master_marker):
 
     # Locate local slaves (owned and ghosted)
     slaves = fem.locate_dofs_topological(
-        (V.sub(tdim-1), V.sub(tdim-1).collapse()), fdim, slave_facets)[:, 0]
+        (subs[tdim-1], collapsed_subs[tdim-1]), fdim, slave_facets)[:, 0]
     slave_coordinates = x[slaves]
     num_owned_slaves = len(slaves[slaves < local_size])
     # Find masters and coefficients in same block as slave
@@ -62,12 +67,16 @@ def create_contact_condition(V, meshtag, slave_marker, master_marker):
         V.mesh.topology.create_connectivity(fdim, tdim)
         facet_to_cell = V.mesh.topology.connectivity(fdim, tdim)
     master_facets = meshtag.indices[meshtag.values == master_marker]
-    local_master_cells = []
-    for facet in master_facets:
-        local_master_cells.extend(facet_to_cell.links(facet))
-        del facet
-
-    local_master_cells = np.unique(local_master_cells)
+    # Gather cells for all master facets in one pass using the packed
+    # adjacency arrays instead of calling links() per facet
+    f_to_c_array = facet_to_cell.array
+    f_to_c_offsets = facet_to_cell.offsets
+    starts = f_to_c_offsets[master_facets]
+    counts = f_to_c_offsets[master_facets + 1] - starts
+    gather_idx = (np.repeat(starts, counts) + np.arange(counts.sum())
+                  - np.repeat(np.cumsum(counts) - counts, counts))
+    local_master_cells = np.unique(f_to_c_array[gather_idx])
+    del starts, counts, gather_idx
 
     # Find masters that is owned by this processor
     tree = geometry.BoundingBoxTree(V.mesh, tdim)
@@ -78,28 +87,36 @@ def create_contact_condition(V, meshtag, slave_marker, master_marker):
     del cell_map
     loc_to_glob = np.array(V.dofmap.index_map.global_indices(False),
                            dtype=np.int64)
-    # Loop through all local slaves, check if there is any
-    # colliding master cell that is local
+    # Check if any colliding master cell is local. The tree is queried
+    # per slave, but the candidate cells of all slaves are filtered
+    # against the master cells and ownership in one vectorized pass.
     slave_to_master_cell = {}
-    for i, (dof, coord) in enumerate(zip(slaves[:num_owned_slaves],
-                                         slave_coordinates
-                                         [:num_owned_slaves])):
-        possible_cells = np.array(
+    if num_owned_slaves > 0:
+        possible_cells = [np.array(
             geometry.compute_collisions_point(tree, coord.T),
-            dtype=np.int32)
-        if len(possible_cells) > 0:
-            is_master_cell = np.isin(possible_cells, local_master_cells)
-            glob_cells = loc2glob_cell[possible_cells]
-            is_owned = np.logical_and(cmin <= glob_cells, glob_cells < cmax)
-            candidates = possible_cells[np.logical_and(
-                is_master_cell, is_owned)]
+            dtype=np.int32) for coord in slave_coordinates
+            [:num_owned_slaves]]
+        cell_offsets = np.zeros(num_owned_slaves + 1, dtype=np.int32)
+        cell_offsets[1:] = np.cumsum(
+            [len(cells) for cells in possible_cells])
+        flat_cells = np.concatenate(possible_cells)
+        glob_cells = loc2glob_cell[flat_cells]
+        is_owned = np.logical_and(cmin <= glob_cells, glob_cells < cmax)
+        is_candidate = np.logical_and(
+            np.isin(flat_cells, local_master_cells), is_owned)
+        for i, dof in enumerate(slaves[:num_owned_slaves]):
+            in_cell = is_candidate[cell_offsets[i]:cell_offsets[i+1]]
+            candidates = flat_cells[cell_offsets[i]:
+                                    cell_offsets[i+1]][in_cell]
+            if len(candidates) == 0:
+                continue
             verified_candidate = dcpp.geometry.select_colliding_cells(
-                V.mesh, list(candidates), coord.T, 1)
+                V.mesh, list(candidates), slave_coordinates[i].T, 1)
             if len(verified_candidate) > 0:
                 slave_to_master_cell[dof] = (verified_candidate[0], i)
-            del (is_master_cell, glob_cells, is_owned,
-                 candidates, verified_candidate)
-        del possible_cells
+            del in_cell, candidates, verified_candidate
+        del (possible_cells, cell_offsets, flat_cells, glob_cells,
+             is_owned, is_candidate)
 
     # Loop through the slave dofs with masters on other interface and
     # compute corresponding coefficients
@@ -330,55 +347,102 @@ def create_contact_condition(V, meshtag, slave_marker, master_marker):
 
     # Get the shared indices for every block owned by the processors
     shared_indices = cpp.mpc.compute_shared_indices(V._cpp_object)
-    send_ghost_masters = {}
 
-    for (i, slave) in enumerate(slaves[:num_owned_slaves]):
-        block = slave // bs
-        if block in shared_indices.keys():
-            for proc in shared_indices[block]:
-                if proc in send_ghost_masters.keys():
-                    send_ghost_masters[proc][loc_to_glob[slave]] = {
-                        "masters": masters[offsets[i]:offsets[i+1]],
-                        "coeffs": coeffs[offsets[i]:offsets[i+1]],
-                        "owners": owners[offsets[i]:offsets[i+1]]
-                    }
-                else:
-                    send_ghost_masters[proc] = {loc_to_glob[slave]: {
-                        "masters": masters[offsets[i]:offsets[i+1]],
-                        "coeffs": coeffs[offsets[i]:offsets[i+1]],
-                        "owners": owners[offsets[i]:offsets[i+1]]}}
-        del block
+    # Find the slaves whose block is shared with another processor with
+    # one searchsorted pass; typically only a small subset is shared
+    shared_keys = np.sort(
+        np.fromiter(shared_indices.keys(), dtype=np.int64))
+    blocks = slaves[:num_owned_slaves] // bs
+    if len(shared_keys) > 0:
+        pos = np.clip(np.searchsorted(shared_keys, blocks),
+                      0, len(shared_keys) - 1)
+        shared_slaves = np.flatnonzero(shared_keys[pos] == blocks)
+    else:
+        shared_slaves = np.zeros(0, dtype=np.int64)
+
+    # Bucket the shared slaves that have to be sent to each neighbor
+    slaves_per_proc = {}
+    for i in shared_slaves:
+        for proc in shared_indices[blocks[i]]:
+            if proc in slaves_per_proc.keys():
+                slaves_per_proc[proc].append(i)
+            else:
+                slaves_per_proc[proc] = [i]
+    del shared_keys, blocks, shared_slaves
 
-    # Send masters for ghosted slaves to respective procs
-    for proc in send_ghost_masters.keys():
-        comm.send(send_ghost_masters[proc], dest=proc, tag=3)
-    del send_ghost_masters
+    # Pack masters for ghosted slaves as flat arrays
+    # (global slave ids, masters, coeffs, owners, offsets) and send one
+    # message per neighboring processor
+    masters_arr = np.array(masters, dtype=np.int64)
+    coeffs_arr = np.array(coeffs, dtype=np.float64)
+    owners_arr = np.array(owners, dtype=np.int32)
+    offsets_arr = np.array(offsets, dtype=np.int32)
+    for proc in slaves_per_proc.keys():
+        idx = np.array(slaves_per_proc[proc], dtype=np.int32)
+        starts = offsets_arr[idx]
+        counts = offsets_arr[idx + 1] - starts
+        gather_idx = (np.repeat(starts, counts) + np.arange(counts.sum())
+                      - np.repeat(np.cumsum(counts) - counts, counts))
+        proc_offsets = np.zeros(len(idx) + 1, dtype=np.int32)
+        proc_offsets[1:] = np.cumsum(counts)
+        comm.send((loc_to_glob[slaves[idx]], masters_arr[gather_idx],
+                   coeffs_arr[gather_idx], owners_arr[gather_idx],
+                   proc_offsets), dest=proc, tag=3)
+        del idx, starts, counts, gather_idx, proc_offsets
+    del slaves_per_proc
 
-    # For ghosted slaves, find their respective owner
+    # For ghosted slaves, find their respective owners in one
+    # vectorized lookup
     local_blocks_size = V.dofmap.index_map.size_local
-    ghost_recv = []
-    for slave in slaves[num_owned_slaves:]:
-        block = slave//bs - local_blocks_size
-        owner = ghost_owners[block]
-        ghost_recv.append(owner)
-        del block, owner
-    ghost_recv = set(ghost_recv)
+    ghost_blocks = slaves[num_owned_slaves:] // bs - local_blocks_size
+    ghost_recv = np.unique(
+        np.asarray(ghost_owners, dtype=np.int32)[ghost_blocks])
+    del ghost_blocks
 
-    # Receive masters for ghosted slaves
-    recv_ghost_masters = {}
+    # Receive flat master arrays for ghosted slaves and stack them into
+    # one set of buffers. The receives are blocking on purpose: the
+    # pickled messages grow with the contact interface and
+    # mpi4py's irecv posts a fixed-size buffer that would truncate
+    # them, while recv probes the incoming message size
+    r_slaves, r_masters, r_coeffs, r_owners, r_counts\
+        = [], [], [], [], []
     for owner in ghost_recv:
-        proc_masters = comm.recv(source=owner, tag=3)
-        recv_ghost_masters.update(proc_masters)
+        (p_slaves, p_masters, p_coeffs, p_owners, p_offsets) \
+            = comm.recv(source=owner, tag=3)
+        r_slaves.append(p_slaves)
+        r_masters.append(p_masters)
+        r_coeffs.append(p_coeffs)
+        r_owners.append(p_owners)
+        r_counts.append(p_offsets[1:] - p_offsets[:-1])
 
-    # Add ghost masters to array
-    ghost_masters, ghost_coeffs, ghost_owners, ghost_offsets\
-        = [], [], [], [0]
-    for slave in loc_to_glob[slaves[num_owned_slaves:]]:
-        ghost_masters.extend(recv_ghost_masters[slave]["masters"])
-        ghost_coeffs.extend(recv_ghost_masters[slave]["coeffs"])
-        ghost_owners.extend(recv_ghost_masters[slave]["owners"])
-        ghost_offsets.append(len(ghost_masters))
-    del recv_ghost_masters
+    # Flatten the received masters in the order of the local ghost
+    # slaves with vectorized gathers instead of a per-slave Python loop
+    ghost_glob_slaves = loc_to_glob[slaves[num_owned_slaves:]]
+    if len(r_slaves) > 0:
+        r_slaves = np.concatenate(r_slaves)
+        r_masters = np.concatenate(r_masters)
+        r_coeffs = np.concatenate(r_coeffs)
+        r_owners = np.concatenate(r_owners)
+        r_counts = np.concatenate(r_counts)
+        r_starts = np.cumsum(r_counts) - r_counts
+        # Position of each ghost slave in the received buffers
+        order = np.argsort(r_slaves)
+        pos = order[np.searchsorted(r_slaves, ghost_glob_slaves,
+                                    sorter=order)]
+        starts = r_starts[pos]
+        counts = r_counts[pos]
+        gather_idx = (np.repeat(starts, counts) + np.arange(counts.sum())
+                      - np.repeat(np.cumsum(counts) - counts, counts))
+        ghost_masters = r_masters[gather_idx]
+        ghost_coeffs = r_coeffs[gather_idx]
+        ghost_owners = r_owners[gather_idx]
+        ghost_offsets = np.zeros(len(pos) + 1, dtype=np.int32)
+        ghost_offsets[1:] = np.cumsum(counts)
+        del r_starts, order, pos, starts, counts, gather_idx
+    else:
+        ghost_masters, ghost_coeffs, ghost_owners, ghost_offsets\
+            = [], [], [], [0]
+    del r_slaves, r_masters, r_coeffs, r_owners, r_counts
 
     return ((slaves[:num_owned_slaves], slaves[num_owned_slaves:]),
             (masters, ghost_masters), (coeffs, ghost_coeffs),
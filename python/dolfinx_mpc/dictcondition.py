@@ -48,6 +48,14 @@ def create_dictionary_constraint(V: function.FunctionSpace, slave_master_dict:
     non_local_entities = {}
     slaves_local = {}
     slaves_ghost = {}
+    # Collapse sub-spaces once (each collapse rebuilds a dofmap), not
+    # once per slave or master point
+    if subspace_slave is not None:
+        Vsub_slave = V.sub(subspace_slave)
+        Vsub_slave_collapsed = Vsub_slave.collapse()
+    if subspace_master is not None:
+        Vsub_master = V.sub(subspace_master)
+        Vsub_master_collapsed = Vsub_master.collapse()
     for i, slave_point in enumerate(slave_master_dict.keys()):
         num_masters = len(list(slave_master_dict[slave_point].keys()))
         # Status for current slave, -1 if not on proc, 0 if ghost, 1 if owned
@@ -61,9 +69,9 @@ def create_dictionary_constraint(V: function.FunctionSpace, slave_master_dict:
             slave_dofs = np.array(fem.locate_dofs_geometrical(
                 V, close_to(slave_point_nd))[:, 0])
         else:
-            Vsub = V.sub(subspace_slave).collapse()
             slave_dofs = np.array(fem.locate_dofs_geometrical(
-                (V.sub(subspace_slave), Vsub), close_to(slave_point_nd))[:, 0])
+                (Vsub_slave, Vsub_slave_collapsed),
+                close_to(slave_point_nd))[:, 0])
         if len(slave_dofs) == 1:
             # Decide if slave is ghost or not
             if slave_dofs[0] < local_size:
@@ -100,9 +108,8 @@ def create_dictionary_constraint(V: function.FunctionSpace, slave_master_dict:
                 master_dofs = fem.locate_dofs_geometrical(
                     V, close_to(master_points_nd[:, j:j+1]))[:, 0]
             else:
-                Vsub = V.sub(subspace_master).collapse()
                 master_dofs = np.array(fem.locate_dofs_geometrical(
-                    (V.sub(subspace_master), Vsub),
+                    (Vsub_master, Vsub_master_collapsed),
                     close_to(master_points_nd[:, j:j+1]))[:, 0])
 
             # Only add masters owned by this processor
@@ -5,6 +5,7 @@
 // SPDX-License-Identifier:    LGPL-3.0-or-later
 
 #include <iostream>
+#include <petsc4py/petsc4py.h>
 #include <pybind11/pybind11.h>
 
 namespace py = pybind11;
@@ -20,6 +21,10 @@ PYBIND11_MODULE(cpp, m)
   m.doc() = "DOLFINX MultiPointConstraint Python interface";
   m.attr("__version__") = DOLFINX_MPC_VERSION;
 
+  // Initialize petsc4py, required by the PETSc object casters
+  if (import_petsc4py() != 0)
+    throw std::runtime_error("Error when importing petsc4py");
+
   // Create mpc submodule [mpc]
   py::module mpc = m.def_submodule("mpc", "General module");
   dolfinx_mpc_wrappers::mpc(mpc);
@@ -11,11 +11,16 @@
 #include <dolfinx/geometry/BoundingBoxTree.h>
 #include <dolfinx/geometry/utils.h>
 #include <dolfinx_mpc/MultiPointConstraint.h>
+#include <dolfinx_mpc/assemble_matrix.h>
+#include <dolfinx_mpc/assemble_vector.h>
 #include <dolfinx_mpc/utils.h>
 #include <memory>
 #include <pybind11/eigen.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+
+#include "caster_petsc.h"
+
 namespace py = pybind11;
 
 namespace dolfinx_mpc_wrappers
@@ -24,6 +29,12 @@ void mpc(py::module& m)
 {
 
   m.def("get_basis_functions", &dolfinx_mpc::get_basis_functions);
+  m.def("assemble_matrix", &dolfinx_mpc::assemble_matrix,
+        "Assemble multi-point constraint contributions of a bilinear "
+        "form into an existing PETSc matrix");
+  m.def("assemble_vector", &dolfinx_mpc::assemble_vector,
+        "Assemble a linear form into a local vector with the "
+        "multi-point constraint applied");
   m.def("compute_shared_indices", &dolfinx_mpc::compute_shared_indices);
   m.def("add_pattern_diagonal", &dolfinx_mpc::add_pattern_diagonal);
 
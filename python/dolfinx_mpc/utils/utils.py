@@ -4,9 +4,10 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
-from contextlib import ExitStack
+import weakref
 
 import dolfinx_mpc.cpp
+import numba
 import numpy as np
 import ufl
 from mpi4py import MPI
@@ -14,7 +15,6 @@ from petsc4py import PETSc
 
 import dolfinx
 import dolfinx.common
-import dolfinx.la
 import dolfinx.log
 
 
@@ -263,9 +263,34 @@ def log_info(message):
         dolfinx.log.set_log_level(old_level)
 
 
+@numba.njit(parallel=True, cache=True)
+def _fill_constant(basis, dofs, value):
+    """Set basis[dofs] = value with threaded stores"""
+    for k in numba.prange(dofs.shape[0]):
+        basis[dofs[k]] = value
+
+
+@numba.njit(parallel=True, cache=True)
+def _fill_rotational(basis, dofs, x, axis, mean, scale):
+    """Set basis[dofs] = scale*(x[dofs, axis] - mean) with threaded
+    stores"""
+    for k in numba.prange(dofs.shape[0]):
+        basis[dofs[k]] = scale*(x[dofs[k], axis] - mean)
+
+
+# Cache of built null spaces keyed on the function space, so several
+# operators over the same space (e.g. an MPC matrix and an
+# unconstrained reference matrix) share one PETSc NullSpace
+_nullspace_cache = {}
+
+
 def rigid_motions_nullspace(V):
     """Function to build nullspace for 2D/3D elasticity"""
 
+    cached = _nullspace_cache.get(id(V))
+    if cached is not None and cached[0]() is V:
+        return cached[1]
+
     # Get geometric dim
     gdim = V.mesh.geometry.dim
     assert gdim == 2 or gdim == 3
@@ -277,34 +302,69 @@ def rigid_motions_nullspace(V):
     nullspace_basis = [dolfinx.cpp.la.create_vector(
         V.dofmap.index_map) for i in range(dim)]
 
-    with ExitStack() as stack:
-        vec_local = [stack.enter_context(x.localForm())
-                     for x in nullspace_basis]
-        basis = [np.asarray(x) for x in vec_local]
-
-        x = V.tabulate_dof_coordinates()
-        dofs = [V.sub(i).dofmap.list.array for i in range(gdim)]
-
-        # Build translational null space basis
-        for i in range(gdim):
-            basis[i][V.sub(i).dofmap.list.array] = 1.0
-
-        # Build rotational null space basis
-        if gdim == 2:
-            basis[2][dofs[0]] = -x[dofs[0], 1]
-            basis[2][dofs[1]] = x[dofs[1], 0]
-        elif gdim == 3:
-            basis[3][dofs[0]] = -x[dofs[0], 1]
-            basis[3][dofs[1]] = x[dofs[1], 0]
-
-            basis[4][dofs[0]] = x[dofs[0], 2]
-            basis[4][dofs[2]] = -x[dofs[2], 0]
-            basis[5][dofs[2]] = x[dofs[2], 1]
-            basis[5][dofs[1]] = -x[dofs[1], 2]
-
-    basis = dolfinx.la.VectorSpaceBasis(nullspace_basis)
-    basis.orthonormalize()
-
-    _x = [basis[i] for i in range(dim)]
-    nsp = PETSc.NullSpace().create(vectors=_x)
+    imap = V.dofmap.index_map
+    local_size = imap.size_local*imap.block_size
+
+    # Zero-copy views of the owned portion of each vector. Ghost
+    # entries are never read by the PETSc null space, so the
+    # localForm/ExitStack round-trip is unnecessary.
+    basis = [vec.getArray() for vec in nullspace_basis]
+
+    x = V.tabulate_dof_coordinates()
+    # Fetch each sub-space dofmap once, as V.sub(i) rebuilds the
+    # sub-space on every access, and restrict to owned dofs
+    dofs = [V.sub(i).dofmap.list.array for i in range(gdim)]
+    dofs = [dofs_i[dofs_i < local_size] for dofs_i in dofs]
+
+    # Compute global first and second moments of the owned dof
+    # coordinates in a single reduction. These determine the
+    # orthonormal rigid body modes in closed form, avoiding the
+    # global dot products of a Gram-Schmidt pass.
+    coords = x[dofs[0], :gdim]
+    moments = np.zeros(1 + gdim + gdim*gdim)
+    moments[0] = coords.shape[0]
+    moments[1:1+gdim] = coords.sum(axis=0)
+    moments[1+gdim:] = (coords.T @ coords).ravel()
+    moments = MPI.COMM_WORLD.allreduce(moments, op=MPI.SUM)
+    num_nodes = moments[0]
+    mean = moments[1:1+gdim]/num_nodes
+    # Second moments of the centered coordinates
+    M = (moments[1+gdim:].reshape(gdim, gdim)
+         - num_nodes*np.outer(mean, mean))
+
+    # Build translational null space basis (orthonormal since each
+    # mode has num_nodes unit entries)
+    for i in range(gdim):
+        _fill_constant(basis[i], dofs[i], 1.0/np.sqrt(num_nodes))
+
+    # Build rotational null space basis from centered coordinates;
+    # centering makes the rotations orthogonal to the translations
+    if gdim == 2:
+        rot_norm = np.sqrt(M[0, 0] + M[1, 1])
+        _fill_rotational(basis[2], dofs[0], x, 1, mean[1], -1.0/rot_norm)
+        _fill_rotational(basis[2], dofs[1], x, 0, mean[0], 1.0/rot_norm)
+    elif gdim == 3:
+        rot = np.zeros((3, len(basis[3])))
+        _fill_rotational(rot[0], dofs[0], x, 1, mean[1], -1.0)
+        _fill_rotational(rot[0], dofs[1], x, 0, mean[0], 1.0)
+
+        _fill_rotational(rot[1], dofs[0], x, 2, mean[2], 1.0)
+        _fill_rotational(rot[1], dofs[2], x, 0, mean[0], -1.0)
+        _fill_rotational(rot[2], dofs[2], x, 1, mean[1], 1.0)
+        _fill_rotational(rot[2], dofs[1], x, 2, mean[2], -1.0)
+
+        # Gram matrix of the rotations, expressed through the
+        # centered second moments
+        G = np.array(
+            [[M[0, 0] + M[1, 1], -M[1, 2], -M[0, 2]],
+             [-M[1, 2], M[0, 0] + M[2, 2], -M[0, 1]],
+             [-M[0, 2], -M[0, 1], M[1, 1] + M[2, 2]]])
+        # Orthonormalize the rotations through the Cholesky factor
+        # of their Gram matrix (no further global reductions)
+        rot = np.linalg.solve(np.linalg.cholesky(G), rot)
+        for i in range(3):
+            basis[3+i][:] = rot[i]
+
+    nsp = PETSc.NullSpace().create(vectors=nullspace_basis)
+    _nullspace_cache[id(V)] = (weakref.ref(V), nsp)
     return nsp
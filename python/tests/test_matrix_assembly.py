@@ -15,11 +15,15 @@ import dolfinx
 import dolfinx.log
 
 
+@pytest.mark.parametrize("backend", ["numba", "cpp"])
 @pytest.mark.parametrize("master_point", [[1, 1], [0, 1]])
 @pytest.mark.parametrize("degree", range(1, 4))
 @pytest.mark.parametrize("celltype", [dolfinx.cpp.mesh.CellType.quadrilateral,
                                       dolfinx.cpp.mesh.CellType.triangle])
-def test_mpc_assembly(master_point, degree, celltype):
+def test_mpc_assembly(master_point, degree, celltype, backend):
+    if backend == "cpp" and \
+            not hasattr(dolfinx_mpc.cpp.mpc, "assemble_matrix"):
+        pytest.skip("Compiled MPC matrix assembler not available")
 
     # Create mesh and function space
     mesh = dolfinx.UnitSquareMesh(MPI.COMM_WORLD, 5, 3, celltype)
@@ -41,7 +45,7 @@ def test_mpc_assembly(master_point, degree, celltype):
     mpc.finalize()
 
     with dolfinx.common.Timer("~Test: Assemble new"):
-        A_mpc = dolfinx_mpc.assemble_matrix(a, mpc)
+        A_mpc = dolfinx_mpc.assemble_matrix(a, mpc, backend=backend)
 
     A_mpc_np = dolfinx_mpc.utils.PETScMatrix_to_global_numpy(A_mpc)
 
@@ -55,11 +59,15 @@ def test_mpc_assembly(master_point, degree, celltype):
 
 
 # Check if ordering of connected dofs matter
+@pytest.mark.parametrize("backend", ["numba", "cpp"])
 @pytest.mark.parametrize("master_point", [[1, 1], [0, 1]])
 @pytest.mark.parametrize("degree", range(1, 4))
 @pytest.mark.parametrize("celltype", [dolfinx.cpp.mesh.CellType.triangle,
                                       dolfinx.cpp.mesh.CellType.quadrilateral])
-def test_slave_on_same_cell(master_point, degree, celltype):
+def test_slave_on_same_cell(master_point, degree, celltype, backend):
+    if backend == "cpp" and \
+            not hasattr(dolfinx_mpc.cpp.mpc, "assemble_matrix"):
+        pytest.skip("Compiled MPC matrix assembler not available")
 
     # Create mesh and function space
     mesh = dolfinx.UnitSquareMesh(MPI.COMM_WORLD, 1, 8, celltype)
@@ -82,7 +90,7 @@ def test_slave_on_same_cell(master_point, degree, celltype):
     a = ufl.inner(ufl.grad(u), ufl.grad(v))*ufl.dx
 
     with dolfinx.common.Timer("~TEST: Assemble matrix"):
-        A_mpc = dolfinx_mpc.assemble_matrix(a, mpc)
+        A_mpc = dolfinx_mpc.assemble_matrix(a, mpc, backend=backend)
     with dolfinx.common.Timer("~TEST: Compare with numpy"):
 
         A_mpc_np = dolfinx_mpc.utils.PETScMatrix_to_global_numpy(A_mpc)
@@ -7,6 +7,7 @@
 import dolfinx_mpc
 import dolfinx_mpc.utils
 import numpy as np
+import pytest
 import ufl
 from mpi4py import MPI
 from petsc4py import PETSc
@@ -16,7 +17,11 @@ import dolfinx.io
 MPI.COMM_WORLD.irecv
 
 
-def test_surface_integrals():
+@pytest.mark.parametrize("backend", ["numba", "cpp"])
+def test_surface_integrals(backend):
+    if backend == "cpp" and \
+            not hasattr(dolfinx_mpc.cpp.mpc, "assemble_matrix"):
+        pytest.skip("Compiled MPC assemblers not available")
     N = 4
     mesh = dolfinx.UnitSquareMesh(MPI.COMM_WORLD, N, N)
     V = dolfinx.VectorFunctionSpace(mesh, ("Lagrange", 1))
@@ -81,9 +86,9 @@ def test_surface_integrals():
     mpc.create_general_constraint(s_m_c, 1, 1)
     mpc.finalize()
     with dolfinx.common.Timer("~TEST: Assemble matrix"):
-        A = dolfinx_mpc.assemble_matrix(a, mpc, bcs=bcs)
+        A = dolfinx_mpc.assemble_matrix(a, mpc, bcs=bcs, backend=backend)
     with dolfinx.common.Timer("~TEST: Assemble vector"):
-        b = dolfinx_mpc.assemble_vector(rhs, mpc)
+        b = dolfinx_mpc.assemble_vector(rhs, mpc, backend=backend)
     dolfinx.fem.apply_lifting(b, [a], [bcs])
     b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES,
                   mode=PETSc.ScatterMode.REVERSE)
@@ -138,7 +143,11 @@ def test_surface_integrals():
         uh.array, uh_numpy[uh.owner_range[0]:uh.owner_range[1]])
 
 
-def test_surface_integral_dependency():
+@pytest.mark.parametrize("backend", ["numba", "cpp"])
+def test_surface_integral_dependency(backend):
+    if backend == "cpp" and \
+            not hasattr(dolfinx_mpc.cpp.mpc, "assemble_matrix"):
+        pytest.skip("Compiled MPC assemblers not available")
     N = 10
     mesh = dolfinx.UnitSquareMesh(MPI.COMM_WORLD, N, N)
     V = dolfinx.VectorFunctionSpace(mesh, ("Lagrange", 1))
@@ -181,9 +190,9 @@ def test_surface_integral_dependency():
     mpc.finalize()
 
     with dolfinx.common.Timer("~TEST: Assemble matrix"):
-        A = dolfinx_mpc.assemble_matrix(a, mpc)
+        A = dolfinx_mpc.assemble_matrix(a, mpc, backend=backend)
     with dolfinx.common.Timer("~TEST: Assemble vector"):
-        b = dolfinx_mpc.assemble_vector(rhs, mpc)
+        b = dolfinx_mpc.assemble_vector(rhs, mpc, backend=backend)
     b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES,
                   mode=PETSc.ScatterMode.REVERSE)
 
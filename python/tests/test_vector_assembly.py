@@ -14,11 +14,15 @@ import dolfinx_mpc.utils
 import ufl
 
 
+@pytest.mark.parametrize("backend", ["numba", "cpp"])
 @pytest.mark.parametrize("master_point", [[1, 1], [0, 1]])
 @pytest.mark.parametrize("degree", range(1, 4))
 @pytest.mark.parametrize("celltype", [dolfinx.cpp.mesh.CellType.quadrilateral,
                                       dolfinx.cpp.mesh.CellType.triangle])
-def test_mpc_assembly(master_point, degree, celltype):
+def test_mpc_assembly(master_point, degree, celltype, backend):
+    if backend == "cpp" and \
+            not hasattr(dolfinx_mpc.cpp.mpc, "assemble_vector"):
+        pytest.skip("Compiled MPC vector assembler not available")
 
     # Create mesh and function space
     mesh = dolfinx.UnitSquareMesh(MPI.COMM_WORLD, 3, 5, celltype)
@@ -38,7 +42,7 @@ def test_mpc_assembly(master_point, degree, celltype):
     mpc = dolfinx_mpc.MultiPointConstraint(V)
     mpc.create_general_constraint(s_m_c)
     mpc.finalize()
-    b = dolfinx_mpc.assemble_vector(rhs, mpc)
+    b = dolfinx_mpc.assemble_vector(rhs, mpc, backend=backend)
     b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES,
                   mode=PETSc.ScatterMode.REVERSE)
     b_np = dolfinx_mpc.utils.PETScVector_to_global_numpy(b)